@@ -2,12 +2,44 @@
 
 from playhouse.postgres_ext import PostgresqlExtDatabase
 from chromadb import PersistentClient
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from app.utils.embedding_cache import EmbeddingCache
 import os
 
 db = PostgresqlExtDatabase(None)
 
 chroma_client = None
 knowledge_base_collection = None
+embedding_function = None
+embedding_cache = None
+
+# chroma默认的嵌入模型
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+KNOWLEDGE_BASE_COLLECTION = "knowledge_base"
+# scripts/compact_knowledge_base.py重建集合时使用的临时集合和替换过程中的备份集合
+KNOWLEDGE_BASE_COMPACT_COLLECTION = KNOWLEDGE_BASE_COLLECTION + "__compact"
+KNOWLEDGE_BASE_BACKUP_COLLECTION = KNOWLEDGE_BASE_COLLECTION + "__old"
+
+
+def recover_knowledge_base_swap():
+    """恢复压缩脚本在替换集合时中断留下的状态，必须在打开知识库集合之前调用。
+
+    替换分两步：原集合先重命名为备份集合，校验过的新集合再重命名为原名。
+    原名集合不存在时，说明中断发生在两步之间，把备份集合恢复为原名；没有备份时使用临时集合。
+    原名集合存在时，遗留的备份集合属于已完成的替换，直接删除。
+    """
+    names = {collection.name for collection in chroma_client.list_collections()}
+    if KNOWLEDGE_BASE_COLLECTION not in names:
+        for name in (KNOWLEDGE_BASE_BACKUP_COLLECTION, KNOWLEDGE_BASE_COMPACT_COLLECTION):
+            if name in names:
+                chroma_client.get_collection(name, embedding_function=embedding_function).modify(
+                    name=KNOWLEDGE_BASE_COLLECTION)
+                names.discard(name)
+                names.add(KNOWLEDGE_BASE_COLLECTION)
+                print(f"Restored interrupted knowledge base swap from collection {name}")
+                break
+    if KNOWLEDGE_BASE_COLLECTION in names and KNOWLEDGE_BASE_BACKUP_COLLECTION in names:
+        chroma_client.delete_collection(KNOWLEDGE_BASE_BACKUP_COLLECTION)
 
 def initialize_extensions():
     # initialize database
@@ -20,5 +52,16 @@ def initialize_extensions():
     # initialize chroma
     global chroma_client
     chroma_client = PersistentClient(path=os.getenv("CHROMA_PERSIST_DIRECTORY"))
+    global embedding_function
+    embedding_function = DefaultEmbeddingFunction()
+    # 否则中断的替换会导致这里新建一个空的知识库集合
+    recover_knowledge_base_swap()
     global knowledge_base_collection
-    knowledge_base_collection = chroma_client.get_or_create_collection("knowledge_base")
\ No newline at end of file
+    knowledge_base_collection = chroma_client.get_or_create_collection(
+        KNOWLEDGE_BASE_COLLECTION, embedding_function=embedding_function)
+
+    # initialize embedding cache
+    global embedding_cache
+    embedding_cache = EmbeddingCache(
+        os.getenv("EMBEDDING_CACHE_PATH") or os.path.join(os.getenv("CHROMA_PERSIST_DIRECTORY") or ".", "embedding_cache.sqlite3"),
+        EMBEDDING_MODEL_NAME)
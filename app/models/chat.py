@@ -8,6 +8,9 @@ class Chat(BaseModel):
     user = ForeignKeyField(User, backref='chats')
     title = CharField(max_length=255, default="新会话")
     is_active = BooleanField(default=True)
+    # 早期对话的滚动摘要，以及已并入摘要的最后一条消息ID
+    summary = TextField(null=True)
+    summary_until = IntegerField(default=0)
     
     class Meta:
         table_name = 'chats'
@@ -28,9 +31,12 @@ class ChatMessage(BaseModel):
     role = CharField(max_length=20, choices=ROLE_CHOICES)
     content = TextField()
     timestamp = DateTimeField(default=datetime.datetime.now)
+    # 客户端提供的幂等键，用户消息和对应的AI回复使用同一个键
+    idempotency_key = CharField(max_length=64, null=True)
     
     class Meta:
         table_name = 'chat_messages'
         indexes = (
             (('chat', 'timestamp'), True),
+            (('chat', 'role', 'idempotency_key'), True),
         )
@@ -8,14 +8,19 @@
 import app.react.tools.analyze_agent
 import app.react.tools.wiki
 #from vertexai.generative_models import Part 
-from app.utils.io import write_to_file
+from app.utils.trace_writer import get_trace_writer
 from app.utils.logging import logger
 #from src.config.setup import config
 #from app.utils.llm.gemini import generate
-from app.utils.llm.deepseek import chat_deepseek
+from app.utils.llm.client import get_client, LLMStreamError
+from app.utils.tokens import estimate_tokens
+from app.utils.json_repair import parse_json_object
+from app.utils.metrics import metrics, log_event
+from app.react.observation import shape_observation, build_summary_prompt
 #from app.utils.llm.silicon import chat_silicon
 #from app.utils.llm.lm_studio import chat_lm_studio
 from app.react.tools_register import student_tools, teacher_tools, admin_tools
+from app.react.tools_register import format_tool_catalogue, get_tool_catalogue
 from app.utils.io import read_file
 from pydantic import BaseModel
 from typing import Callable
@@ -23,16 +28,50 @@ from pydantic import Field
 from typing import Union
 from typing import List 
 from typing import Dict 
+from typing import Optional
+from typing import Tuple
+from typing import Any
+import functools
 import json
+import time
+import uuid
 from app.services.user_service import UserService
 
 from playhouse.shortcuts import model_to_dict
-from flask import session
+from flask import session, has_request_context, copy_current_request_context
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from app.models.user import User
 Observation = Union[str, Exception]
 
 PROMPT_TEMPLATE_PATH = "./data/input/react-Chinese.txt"
 OUTPUT_TRACE_PATH = "./data/output/trace.txt"
+# Stands in for {messages} in the per-run prompt prefix; the only part that changes between iterations
+MESSAGES_SLOT = "\x00messages\x00"
+
+# 工具执行超时(秒)，可按工具名单独配置
+TOOL_TIMEOUT = 30.0
+TOOL_TIMEOUTS = {
+    "learning_analyze": 120.0,
+    "google_search": 20.0,
+    "wikipedia": 15.0,
+}
+
+# 同一步中的多个工具调用并发执行。超时的工具无法被强制终止，会在后台继续运行直至结束。
+_tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="agent-tool")
+
+# 推送给前端的observation事件只包含结果的前若干字符
+OBSERVATION_EVENT_PREVIEW = 500
+
+# 无法解析LLM回复时的重试退避(秒)
+PARSE_RETRY_BACKOFF = 0.5
+PARSE_RETRY_BACKOFF_MAX = 4.0
+
+def _timed_use(use: Callable[[str], Observation], query: str) -> Tuple[Observation, float]:
+    """Runs a tool call and returns its result together with its duration in seconds."""
+    started = time.perf_counter()
+    result = use(query)
+    return result, time.perf_counter() - started
+
 
 class Choice(BaseModel):
     """
@@ -42,6 +81,65 @@ class Choice(BaseModel):
     reason: str = Field(..., description="The reason for choosing this tool.")
 
 
+class RunStatus:
+    """
+    Final states of an agent run.
+    """
+    COMPLETED = "completed"
+    BUDGET_EXHAUSTED = "budget_exhausted"
+    ERROR = "error"
+
+
+class Budget(BaseModel):
+    """
+    Per-run resource limits of the agent.
+    """
+    max_seconds: float = Field(180.0, description="Wall-clock limit of the run in seconds.")
+    max_llm_calls: int = Field(20, description="Maximum number of LLM calls in the run.")
+    max_tokens: int = Field(100000, description="Maximum estimated prompt + completion tokens in the run.")
+    max_parse_failures: int = Field(3, description="Maximum consecutive unparseable LLM responses before giving up.")
+
+
+class RunResult(BaseModel):
+    """
+    The outcome of an agent run.
+    """
+    answer: str = Field(..., description="The final answer, or the best partial answer.")
+    status: str = Field(..., description="One of the RunStatus values.")
+    iterations: int = Field(0, description="Number of think-decide-act iterations.")
+    llm_calls: int = Field(0, description="Number of LLM calls made.")
+    tokens: int = Field(0, description="Estimated prompt + completion tokens used.")
+    elapsed: float = Field(0.0, description="Wall-clock duration of the run in seconds.")
+    error: Optional[str] = Field(None, description="The error message when status is error or budget_exhausted.")
+    json_repairs: int = Field(0, description="Malformed LLM responses fixed locally by the JSON repair parser.")
+    reasks: int = Field(0, description="Unparseable LLM responses that cost another LLM call.")
+    run_id: Optional[str] = Field(None, description="Identifies the run in the trace file and the structured logs.")
+    llm_seconds: float = Field(0.0, description="Time spent waiting for the LLM in seconds.")
+    tool_seconds: float = Field(0.0, description="Time spent executing tool steps in seconds.")
+
+
+class Decision(BaseModel):
+    """
+    The parsed decision of one LLM response.
+    """
+    actions: List[Dict] = Field(default_factory=list, description="Tool calls to execute.")
+    answer: Optional[str] = Field(None, description="The final answer, if the LLM gave one.")
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompt_template(path: str = PROMPT_TEMPLATE_PATH) -> str:
+    """
+    Reads a prompt template once per process.
+
+    Args:
+        path (str): The template path.
+
+    Returns:
+        str: The template content.
+    """
+    return read_file(path)
+
+
 class Message(BaseModel):
     """
     Represents a message with sender role and content.
@@ -90,30 +188,55 @@ class Agent:
     Defines the agent responsible for executing queries and handling tool interactions.
     """
 
-    def __init__(self, model) -> None:
+    def __init__(self, model, budget: Optional[Budget] = None,
+                 on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 provider: Optional[str] = None, cache: Optional[str] = None) -> None:
         """
         Initializes the Agent with a generative model, tools dictionary, and a messages log.
 
         Args:
-            model (GenerativeModel): The generative model used by the agent.
+            model (str): The model name, or None for the provider's default model.
+            budget (Budget, optional): Resource limits of each run. Defaults to Budget().
+            on_event (Callable, optional): Called with (event_type, data) as the run progresses:
+                "token" for each streamed LLM delta, then "thought", "action", "observation" and "answer".
+                When set, LLM responses are streamed.
+            provider (str, optional): The LLM provider in app.utils.llm.client. Defaults to LLM_PROVIDER.
+            cache (str, optional): The LLM response cache entry kind. Leave unset for personalized runs
+                that must always reach the model.
         """
         self.model = model
+        self.llm = get_client(provider)
+        self.cache = cache
         self.tools: Dict[str, Tool] = {}
         self.history: List[Message] = []  # 历史消息记录
         self.messages: List[Message] = [] # 本次任务的观测记录
         self.query = ""
-        self.max_iterations = 20
+        self.budget = budget or Budget()
+        self.on_event = on_event
         self.current_iteration = 0
+        self.llm_calls = 0
+        self.tokens = 0
+        self.json_repairs = 0
+        self.reasks = 0
+        self.llm_seconds = 0.0
+        self.tool_seconds = 0.0
+        self.started_at = 0.0
+        self.run_id: Optional[str] = None
+        self.trace_lines: List[str] = []
         self.template = self.load_template()
+        self.tool_catalogue: Optional[str] = None
+        self.user_info: Optional[Dict[str, Any]] = None
+        self.prompt_prefix: Optional[str] = None
+        self.prompt_components: Dict[str, int] = {}
 
     def load_template(self) -> str:
         """
-        Loads the prompt template from a file.
+        Loads the prompt template, read from disk only once per process.
 
         Returns:
             str: The content of the prompt template file.
         """
-        return read_file(PROMPT_TEMPLATE_PATH)
+        return load_prompt_template(PROMPT_TEMPLATE_PATH)
 
     def register(self, name: str, func: Callable[[str], str], description: str) -> None:
         """
@@ -124,10 +247,11 @@ class Agent:
             func (Callable[[str], str]): The function associated with the tool.
         """
         self.tools[name] = Tool(name, func, description)
+        self.tool_catalogue = None
 
     def trace(self, role: str, content: str) -> None:
         """
-        Logs the message with the specified role and content and writes to file.
+        Logs the message with the specified role and content and adds it to the run's trace.
 
         Args:
             role (str): The role of the message sender.
@@ -135,7 +259,33 @@ class Agent:
         """
         if role != "system":
             self.messages.append(Message(role=role, content=content))
-        write_to_file(path=OUTPUT_TRACE_PATH, content=f"{role}: {content}\n")
+        self.trace_lines.append(f"{role}: {content}\n")
+
+    def flush_trace(self) -> None:
+        """
+        Hands the run's trace to the trace writer as one record, so concurrent runs never interleave in the file.
+        The writer appends it asynchronously.
+        """
+        if not self.trace_lines:
+            return
+        header = f"{'='*50}\nRun {self.run_id} at {time.strftime('%Y-%m-%d %H:%M:%S')}\n{'='*50}\n"
+        get_trace_writer(OUTPUT_TRACE_PATH).write(header + "".join(self.trace_lines))
+        self.trace_lines = []
+
+    def emit(self, event_type: str, **data: Any) -> None:
+        """
+        Reports a progress event to the on_event callback, if any.
+
+        Args:
+            event_type (str): The event type.
+            **data: The event payload.
+        """
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event_type, data)
+        except Exception as e:
+            logger.error(f"Error in agent event callback: {e}")
 
     def add_history(self, role: str, content: str) -> None:
         """
@@ -159,110 +309,355 @@ class Agent:
         """
         return "\n".join([f"{message.role}: {message.content}" for message in self.messages])
 
-    def think(self) -> None:
+    def get_tool_catalogue(self) -> str:
         """
-        Processes the current query, decides actions, and iterates until a solution or max iteration limit is reached.
+        Returns the tool catalogue, formatting it only when the registered tools changed.
+
+        Returns:
+            str: The catalogue inserted into the {tools} placeholder.
         """
-        self.current_iteration += 1
-        logger.info(f"Starting iteration {self.current_iteration}")
-        write_to_file(path=OUTPUT_TRACE_PATH, content=f"\n{'='*50}\nIteration {self.current_iteration}\n{'='*50}\n")
+        if self.tool_catalogue is None:
+            self.tool_catalogue = format_tool_catalogue(self.tools)
+        return self.tool_catalogue
 
-        if self.current_iteration > self.max_iterations:
-            logger.warning("Reached maximum iterations. Stopping.")
-            self.trace("assistant", "I'm sorry, but I couldn't find a satisfactory answer within the allowed number of iterations. Here's what I know so far: " + self.get_messages())
-            return
+    def load_user_info(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the current user's info, queried at most once per run.
+
+        Returns:
+            Optional[Dict[str, Any]]: The user info, or None outside a request or for an unknown user.
+        """
+        if self.user_info is None and has_request_context():
+            self.user_info = UserService.get_user_info(session.get('user_id'))
+        return self.user_info
 
-        prompt = self.template.format(
-            query=self.query, 
-            history=self.get_history(),
-            messages=self.get_messages(),
-            tools='\n\n'.join([
-                f"{str(tool.name)}: \n \'\'\'{tool.description}\n\'\'\'" 
-                for tool in self.tools.values()
-                ]),
-            user_info=json.dumps(UserService.get_user_info(session.get('user_id')), indent=4)
-            #database_schema=database_schema
+    def build_prompt_prefix(self) -> str:
+        """
+        Formats everything in the template that stays fixed during a run: the query, history, tools
+        and user info. Only the {messages} slot is filled in per iteration.
+        The estimated token count of each part is kept in prompt_components.
+
+        Returns:
+            str: The template with MESSAGES_SLOT in place of {messages}.
+        """
+        parts = {
+            "query": self.query,
+            "history": self.get_history(),
+            "tools": self.get_tool_catalogue(),
+            "user_info": json.dumps(self.load_user_info(), indent=4)
+            #"database_schema": database_schema
+        }
+        self.prompt_components = {name: estimate_tokens(text) for name, text in parts.items()}
+        self.prompt_components["template"] = estimate_tokens(
+            self.template.format(messages="", **{name: "" for name in parts})
         )
+        return self.template.format(messages=MESSAGES_SLOT, **parts)
+
+    def think(self) -> str:
+        """
+        Builds the prompt for the current iteration and asks the LLM for the next step.
+
+        Returns:
+            str: The raw LLM response.
+        """
+        self.current_iteration += 1
+        logger.info(f"Starting iteration {self.current_iteration}")
+        self.trace_lines.append(f"\n{'='*50}\nIteration {self.current_iteration}\n{'='*50}\n")
+
+        started = time.perf_counter()
+        if self.prompt_prefix is None:
+            self.prompt_prefix = self.build_prompt_prefix()
+        messages = self.get_messages()
+        prompt = self.prompt_prefix.replace(MESSAGES_SLOT, messages)
+        build_seconds = time.perf_counter() - started
         if self.current_iteration == 1:
             print(prompt)
 
+        # 每次调用都会发送全部组成部分，按调用统计才能看出哪一部分占用最多
+        components = dict(self.prompt_components, messages=estimate_tokens(messages))
+        for component, tokens in components.items():
+            metrics.observe("agent.prompt.tokens", tokens, component=component)
+        metrics.observe("agent.prompt.build_seconds", build_seconds)
+        log_event("agent.prompt", run_id=self.run_id, iteration=self.current_iteration, tokens=components,
+                  build_ms=round(build_seconds * 1000, 3))
+
         response = self.ask_llm(prompt)
         logger.info(f"Thinking => {response}")
         self.trace("assistant", f"Thought: {response}")
-        self.decide(response)
+        self.emit("thought", iteration=self.current_iteration, content=response)
+        return response
 
-    def decide(self, response: str) -> None:
+    def decide(self, response: str) -> Decision:
         """
-        Processes the agent's response, deciding actions or final answers.
+        Parses the agent's response into tool calls or a final answer.
 
         Args:
             response (str): The response generated by the model.
+
+        Returns:
+            Decision: The tool calls to execute, or the final answer.
+
+        Raises:
+            JSONTruncatedError: If the response was cut off. Closing it would turn a partial answer or
+                tool input into a seemingly complete one, so it is re-asked instead.
+            JSONRepairError: If no JSON object can be recovered from the response, even after repair.
+            ValueError: If the JSON has neither "action" nor "answer".
         """
-        try:
-            cleaned_response = response.strip().strip('`').strip()
-            if cleaned_response.startswith('json'):
-                cleaned_response = cleaned_response[4:].strip()
-            
-            parsed_response = json.loads(cleaned_response)
-            
-            if "action" in parsed_response:
-                actions = parsed_response["action"]
-                for action in actions:
-                    tool_name = action["name"]
-                    if not tool_name or tool_name == "none":
-                        logger.info("No action needed. Proceeding to final answer.")
-                    else:
-                        self.trace("assistant", f"Action: Using {tool_name} tool")
-                        self.act(tool_name, action.get("input", self.query))
-                # 处理完所有action后，再进行思考
-                self.think()
-            elif "answer" in parsed_response:
-                self.trace("assistant", f"{parsed_response['answer']}")
-            else:
-                raise ValueError("Invalid response format")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse response: {response}. Error: {str(e)}")
-            self.trace("assistant", "I encountered an error in processing. Let me try again.")
-            self.think()
-        except Exception as e:
-            logger.error(f"Error processing response: {str(e)}")
-            self.trace("assistant", "I encountered an unexpected error. Let me try a different approach.")
-            self.think()
+        # 先严格解析，失败时在本地修复常见的格式错误，避免为格式问题再调用一次LLM；被截断的回复不修复
+        parsed_response, repaired = parse_json_object(response)
+        if repaired:
+            self.json_repairs += 1
+            logger.info(f"Repaired malformed JSON response ({self.json_repairs} this run)")
+        if not isinstance(parsed_response, dict):
+            raise ValueError("Invalid response format")
+        
+        if "action" in parsed_response:
+            actions = parsed_response["action"]
+            # 兼容只给出单个action对象的回复
+            if isinstance(actions, dict):
+                actions = [actions]
+            return Decision(actions=actions)
+        elif "answer" in parsed_response:
+            return Decision(answer=str(parsed_response["answer"]))
+        else:
+            raise ValueError("Invalid response format")
 
-    def act(self, tool_name: str, query: str) -> None:
+    def check_budget(self) -> Optional[str]:
         """
-        Executes the specified tool's function on the query and logs the result.
+        Checks whether the run may start another LLM call.
+
+        Returns:
+            Optional[str]: The reason the budget is exhausted, or None if the run may continue.
+        """
+        elapsed = time.monotonic() - self.started_at
+        if elapsed >= self.budget.max_seconds:
+            return f"time budget of {self.budget.max_seconds}s exhausted"
+        if self.llm_calls >= self.budget.max_llm_calls:
+            return f"LLM call budget of {self.budget.max_llm_calls} exhausted"
+        if self.tokens >= self.budget.max_tokens:
+            return f"token budget of {self.budget.max_tokens} exhausted"
+        return None
+
+    def act_many(self, actions: List[Dict]) -> None:
+        """
+        Executes the tool calls of one step concurrently and records their observations in call order.
+
+        Each tool gets its own timeout (TOOL_TIMEOUTS, falling back to TOOL_TIMEOUT) counted from submission,
+        so the step takes as long as its slowest tool rather than the sum of all tools.
 
         Args:
-            tool_name (str): The tool to be used.
-            query (str): The query for the tool.
-        """
-        tool = self.tools.get(tool_name)
-        if tool:
-            result = tool.use(query)
-            observation = f"Observation from {tool_name}: {result}"
-            self.trace("system", observation)
-            self.messages.append(Message(role="system", content=observation))  # Add observation to message history
-            #self.think()
-        else:
+            actions (List[Dict]): The tool calls, each with "name" and optional "input".
+        """
+        calls = []
+        for action in actions:
+            tool_name = action.get("name")
+            if not tool_name or tool_name == "none":
+                logger.info("No action needed. Proceeding to final answer.")
+                continue
+            self.trace("assistant", f"Action: Using {tool_name} tool")
+            self.emit("action", name=tool_name, input=action.get("input", self.query))
+            calls.append((tool_name, action.get("input", self.query)))
+
+        step_started = time.monotonic()
+        llm_seconds_before = self.llm_seconds
+        submitted = []
+        for tool_name, query in calls:
+            tool = self.tools.get(tool_name)
+            if tool is None:
+                submitted.append((tool_name, None, 0.0))
+                continue
+            # 工具可能读取session，需要在线程中携带当前请求上下文
+            use = copy_current_request_context(tool.use) if has_request_context() else tool.use
+            submitted.append((tool_name, _tool_executor.submit(_timed_use, use, query), time.monotonic()))
+
+        # 按调用顺序等待并记录观察结果，保证顺序确定
+        for tool_name, future, submitted_at in submitted:
+            if future is None:
+                self.record_observation(tool_name, None)
+                continue
+            timeout = TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT)
+            try:
+                result, seconds = future.result(timeout=max(0.0, submitted_at + timeout - time.monotonic()))
+                outcome = "ok"
+            except FutureTimeoutError:
+                logger.error(f"Tool {tool_name} timed out after {timeout}s")
+                result = f"Error: Tool {tool_name} timed out after {timeout}s"
+                seconds, outcome = time.monotonic() - submitted_at, "timeout"
+            self.record_observation(tool_name, result, seconds, outcome)
+
+        # 并发执行时一步的耗时取决于最慢的工具，而不是各工具耗时之和；概括观察结果的LLM时间计入llm_seconds
+        step_seconds = time.monotonic() - step_started - (self.llm_seconds - llm_seconds_before)
+        self.tool_seconds += step_seconds
+        metrics.observe("agent.act.seconds", step_seconds)
+
+    def record_observation(self, tool_name: str, result, seconds: float = 0.0, outcome: str = "ok") -> None:
+        """
+        Records the result of a tool call as an observation, together with its latency and size metrics.
+        The result is shaped first (see app.react.observation), so large results do not bloat later prompts.
+
+        Args:
+            tool_name (str): The tool that was used.
+            result: The tool result, or None if the tool is not registered.
+            seconds (float): How long the tool call took.
+            outcome (str): "ok", or "timeout" if the tool did not finish in time.
+        """
+        if tool_name not in self.tools:
             logger.error(f"No tool registered for choice: {tool_name}")
+            metrics.incr("agent.tool.calls", tool=tool_name, outcome="missing")
             self.trace("system", f"Error: Tool {tool_name} not found")
-            #self.think()
+            self.emit("observation", name=tool_name, content=f"Error: Tool {tool_name} not found")
+            return
+        shaped = shape_observation(tool_name, result, summarizer=self.summarize_observation)
+        observation = f"Observation from {tool_name}: {shaped.text}"
+        metrics.incr("agent.tool.calls", tool=tool_name, outcome=outcome)
+        metrics.observe("agent.tool.seconds", seconds, tool=tool_name)
+        metrics.observe("agent.tool.observation_chars", len(observation), tool=tool_name)
+        metrics.observe("agent.tool.observation_tokens", shaped.tokens, tool=tool_name)
+        metrics.observe("agent.tool.raw_observation_tokens", shaped.raw_tokens, tool=tool_name)
+        if shaped.truncated:
+            metrics.incr("agent.tool.observations_truncated", tool=tool_name)
+        if shaped.summarized:
+            metrics.incr("agent.tool.observations_summarized", tool=tool_name)
+        log_event("agent.tool", run_id=self.run_id, iteration=self.current_iteration, tool=tool_name,
+                  outcome=outcome, seconds=round(seconds, 4), observation_chars=len(observation),
+                  observation_tokens=shaped.tokens, raw_observation_tokens=shaped.raw_tokens,
+                  truncated=shaped.truncated, summarized=shaped.summarized)
+        self.trace("system", observation)
+        self.emit("observation", name=tool_name, content=shaped.text[:OBSERVATION_EVENT_PREVIEW])
+        self.messages.append(Message(role="system", content=observation))  # Add observation to message history
+
+    def summarize_observation(self, tool_name: str, text: str, max_tokens: int) -> Optional[str]:
+        """
+        Asks the LLM to condense an over-cap observation to what matters for the query.
+        The call counts against the run's budget.
+
+        Args:
+            tool_name (str): The tool that produced the observation.
+            text (str): The observation.
+            max_tokens (int): The length the summary should stay within.
 
-    def execute(self, query: str) -> str:
+        Returns:
+            Optional[str]: The summary, or None when the budget is exhausted and the observation should be truncated.
+        """
+        if self.check_budget():
+            return None
+        self.llm_calls += 1
+        prompt = build_summary_prompt(tool_name, self.query, text, max_tokens)
+        started = time.perf_counter()
+        completion = self.llm.complete([{"role": "user", "content": prompt}], model=self.model, cache=self.cache)
+        seconds = time.perf_counter() - started
+        self.llm_seconds += seconds
+        self.charge_tokens(prompt, completion.content or "", completion)
+        metrics.observe("agent.tool.summary_seconds", seconds, tool=tool_name)
+        return completion.content
+
+    def execute(self, query: str) -> RunResult:
         """
         Executes the agent's query-processing workflow.
 
+        The run is an explicit loop: think (ask the LLM), decide (parse the response), then either act on the
+        requested tools and loop, or stop with the final answer. Unparseable, cut-off or interrupted responses
+        are retried with exponential backoff. The loop stops when the LLM answers, the budget is exhausted,
+        or too many consecutive responses cannot be parsed.
+
         Args:
             query (str): The query to be processed.
 
         Returns:
-            str: The final answer or last recorded message content.
+            RunResult: The final answer together with the final state and resource usage of the run.
         """
         self.query = query
+        self.prompt_prefix = None
+        self.run_id = uuid.uuid4().hex[:12]
+        self.llm.start_run()
         self.trace(role="user", content=query)
-        self.think()
-        return self.messages[-1].content
+        self.started_at = time.monotonic()
+        parse_failures = 0
+        status = RunStatus.COMPLETED
+        answer = None
+        error = None
+
+        while True:
+            error = self.check_budget()
+            if error:
+                logger.warning(f"Stopping run: {error}")
+                status = RunStatus.BUDGET_EXHAUSTED
+                break
+
+            try:
+                response = self.think()
+                decision = self.decide(response)
+            except (json.JSONDecodeError, ValueError, LLMStreamError) as e:
+                # 无法解析、被截断或流式中断的回复都重新询问
+                parse_failures += 1
+                logger.error(f"Failed to parse response ({parse_failures}/{self.budget.max_parse_failures}): {str(e)}")
+                if parse_failures >= self.budget.max_parse_failures:
+                    status, error = RunStatus.ERROR, f"LLM response could not be parsed: {str(e)}"
+                    break
+                self.reasks += 1
+                self.trace("assistant", "I encountered an error in processing. Let me try again.")
+                time.sleep(min(PARSE_RETRY_BACKOFF * 2 ** (parse_failures - 1), PARSE_RETRY_BACKOFF_MAX))
+                continue
+            except Exception as e:
+                logger.exception("Error during agent iteration")
+                status, error = RunStatus.ERROR, str(e)
+                break
+            parse_failures = 0
+
+            if decision.answer is not None:
+                answer = decision.answer
+                self.trace("assistant", answer)
+                break
+
+            self.act_many(decision.actions)
+
+        if answer is None:
+            answer = ("I'm sorry, but I couldn't find a satisfactory answer within the allowed resources. "
+                      "Here's what I know so far: " + self.get_messages())
+            self.trace("assistant", answer)
+
+        self.emit("answer", content=answer, status=status)
+        result = RunResult(
+            answer=answer,
+            status=status,
+            iterations=self.current_iteration,
+            llm_calls=self.llm_calls,
+            tokens=self.tokens,
+            elapsed=time.monotonic() - self.started_at,
+            error=error,
+            json_repairs=self.json_repairs,
+            reasks=self.reasks,
+            run_id=self.run_id,
+            llm_seconds=self.llm_seconds,
+            tool_seconds=self.tool_seconds
+        )
+        self.flush_trace()
+        self.record_run(result)
+        return result
+
+    def record_run(self, result: RunResult) -> None:
+        """
+        Adds a finished run to the aggregated metrics and writes its summary as a structured log line.
+
+        Args:
+            result (RunResult): The outcome of the run.
+        """
+        metrics.incr("agent.run.count", status=result.status)
+        metrics.incr("agent.run.json_repairs", result.json_repairs)
+        metrics.incr("agent.run.reasks", result.reasks)
+        metrics.observe("agent.run.iterations", result.iterations)
+        metrics.observe("agent.run.llm_calls", result.llm_calls)
+        metrics.observe("agent.run.tokens", result.tokens)
+        metrics.observe("agent.run.seconds", result.elapsed)
+        metrics.observe("agent.run.llm_seconds", result.llm_seconds)
+        metrics.observe("agent.run.tool_seconds", result.tool_seconds)
+        # 剩余时间为agent自身的开销：提示词构造、解析、重试退避和轨迹写入
+        metrics.observe("agent.run.overhead_seconds",
+                        max(0.0, result.elapsed - result.llm_seconds - result.tool_seconds))
+        log_event("agent.run", run_id=result.run_id, status=result.status, iterations=result.iterations,
+                  llm_calls=result.llm_calls, tokens=result.tokens, seconds=round(result.elapsed, 4),
+                  llm_seconds=round(result.llm_seconds, 4), tool_seconds=round(result.tool_seconds, 4),
+                  json_repairs=result.json_repairs, reasks=result.reasks, error=result.error)
 
     def ask_llm(self, prompt: str) -> str:
         """
@@ -276,39 +671,102 @@ class Agent:
         """
         #contents = [Part.from_text(prompt)]
         #response = generate(self.model, contents)
-        response = chat_deepseek([
+        self.llm_calls += 1
+        messages = [
             {
                 "role": "user",
                 "content": prompt
             }
-        ])
-        return str(response) if response is not None else "No response from LLM"
+        ]
+        started = time.perf_counter()
+        first_token_seconds = None
+        if self.on_event is not None:
+            # 流式输出，让调用方在第一个token到达时就能收到数据
+            deltas = []
+            for delta in self.llm.chat_stream(messages, model=self.model, cache=self.cache, json_mode=True):
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - started
+                deltas.append(delta)
+                self.emit("token", content=delta)
+            response = "".join(deltas) or None
+            usage = None
+        else:
+            completion = self.llm.complete(messages, model=self.model, cache=self.cache, json_mode=True)
+            response = completion.content
+            usage = completion
+        seconds = time.perf_counter() - started
+        self.llm_seconds += seconds
+        response = str(response) if response is not None else "No response from LLM"
+        cached = usage is not None and usage.cached
+        prompt_tokens, completion_tokens, token_source = self.charge_tokens(prompt, response, usage)
+
+        metrics.incr("agent.llm.calls", cached=cached)
+        metrics.observe("agent.llm.seconds", seconds, cached=cached)
+        if first_token_seconds is not None:
+            metrics.observe("agent.llm.first_token_seconds", first_token_seconds)
+        metrics.observe("agent.llm.prompt_tokens", prompt_tokens)
+        metrics.observe("agent.llm.completion_tokens", completion_tokens)
+        log_event("agent.llm", run_id=self.run_id, iteration=self.current_iteration, seconds=round(seconds, 4),
+                  first_token_seconds=round(first_token_seconds, 4) if first_token_seconds is not None else None,
+                  prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, token_source=token_source,
+                  cached=cached, stream=self.on_event is not None)
+        return response
+
+    def charge_tokens(self, prompt: str, response: str, usage=None) -> Tuple[int, int, str]:
+        """
+        Works out the tokens of one LLM call and charges them to the run's budget.
+
+        Args:
+            prompt (str): The prompt sent.
+            response (str): The response received.
+            usage (Completion, optional): The completion, when the call was not streamed.
 
-def run(query: str, role: str, history: List) -> str:
+        Returns:
+            Tuple[int, int, str]: The prompt tokens, the completion tokens, and "provider" or "estimate".
+        """
+        if usage is not None and usage.prompt_tokens is not None:
+            # 优先使用服务端返回的实际token用量
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens or 0
+            self.tokens += prompt_tokens + completion_tokens
+            return prompt_tokens, completion_tokens, "provider"
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(response)
+        if usage is None or not usage.cached:
+            # 缓存命中不消耗token
+            self.tokens += prompt_tokens + completion_tokens
+        return prompt_tokens, completion_tokens, "estimate"
+
+def run(query: str, role: str, history: Optional[List] = None, budget: Optional[Budget] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        cache: Optional[str] = None, provider: Optional[str] = None) -> RunResult:
     """
     Sets up the agent, registers tools, and executes a query.
 
     Args:
         query (str): The query to execute.
         role (str): The role of the user.
-        history (List): The history of the messages.
+        history (List, optional): The history of the messages.
+        budget (Budget, optional): Resource limits of the run.
+        on_event (Callable, optional): Receives progress events, see Agent.
+        cache (str, optional): The LLM response cache entry kind, see Agent.
+        provider (str, optional): The LLM provider, see Agent.
 
     Returns:
-        str: The agent's final answer.
+        RunResult: The agent's final answer and the final state of the run.
     """
-    agent = Agent(model=None)
+    agent = Agent(model=None, budget=budget, on_event=on_event, cache=cache, provider=provider)
     tools =  student_tools if role == "student" \
         else teacher_tools if role == "teacher" \
         else admin_tools
     for name, tool in tools.items(): 
         agent.register(name, tool['function'], tool['description'])
-    for message in history:
+    # 使用注册时预先生成的工具目录
+    agent.tool_catalogue = get_tool_catalogue(role)
+    for message in history or []:
         agent.add_history(message.role, message.content)
-    answer = agent.execute(query)
-    return answer
+    return agent.execute(query)
 
 
 if __name__ == "__main__":
     query = "Can you help me analysis the leanring situation of the students?"
-    final_answer = run(query)
-    logger.info(final_answer)
+    final_answer = run(query, "teacher")
+    logger.info(final_answer.answer)
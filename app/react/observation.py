@@ -0,0 +1,199 @@
+from pydantic import BaseModel, Field
+from typing import Any, Callable, Dict, List, Optional
+import json
+import os
+
+from app.utils.logging import logger
+from app.utils.tokens import estimate_tokens, truncate_to_tokens
+
+OBSERVATION_MAX_TOKENS = int(os.getenv("OBSERVATION_MAX_TOKENS") or 1500)
+OBSERVATION_MAX_BYTES = int(os.getenv("OBSERVATION_MAX_BYTES") or 16384)
+# 超出上限的观察结果是否先请LLM按问题概括，而不是直接截断；各工具可在策略中单独开启或关闭
+OBSERVATION_SUMMARIZE = (os.getenv("OBSERVATION_SUMMARIZE") or "").lower() in ("1", "true", "yes")
+# 交给概括的原始内容上限，避免概括请求本身过大
+SUMMARY_INPUT_TOKENS = 8000
+
+# 嵌套过深的对象(如展开的外键)只保留这些标识字段
+_REFERENCE_KEYS = ("id", "name", "title", "username", "code")
+
+SUMMARY_PROMPT = """以下是工具{tool}返回的结果，内容过长。请针对用户的问题提取其中有用的信息，\
+用不超过{max_tokens}个token概括，保留关键的数字、名称和链接，不要编造结果中没有的内容。
+
+用户问题：{query}
+
+工具结果：
+{observation}"""
+
+
+class ObservationPolicy(BaseModel):
+    """
+    How the result of a tool is shaped before it enters the agent's messages.
+    """
+    max_tokens: int = Field(OBSERVATION_MAX_TOKENS, description="Estimated token cap of the observation.")
+    max_bytes: int = Field(OBSERVATION_MAX_BYTES, description="UTF-8 byte cap of the observation.")
+    max_items: int = Field(30, description="Maximum items kept from each list.")
+    max_string_chars: int = Field(2000, description="Maximum characters kept from each string inside a structured result.")
+    max_depth: int = Field(2, description="Nested objects at this depth or deeper are reduced to their identifying fields.")
+    fields: Optional[List[str]] = Field(None, description="Fields kept from each record; all fields when unset.")
+    summarize: Optional[bool] = Field(None, description="Summarize over-cap observations with the LLM; defaults to OBSERVATION_SUMMARIZE.")
+
+
+COURSE_POLICY = ObservationPolicy(fields=["id", "name", "code", "description", "teacher", "is_active"],
+                                  max_items=50, max_depth=1, max_string_chars=300)
+USER_POLICY = ObservationPolicy(fields=["id", "username", "name", "email", "is_active"], max_items=100)
+
+# 按工具名配置，未配置的工具使用默认策略
+OBSERVATION_POLICIES: Dict[str, ObservationPolicy] = {
+    "google_search": ObservationPolicy(max_items=5, max_tokens=800, max_string_chars=500),
+    "wikipedia": ObservationPolicy(max_tokens=800, max_string_chars=3000),
+    "search_knowledge_base": ObservationPolicy(max_tokens=2000, max_string_chars=800),
+    "get_all_courses": COURSE_POLICY,
+    "get_courses_by_teacher": COURSE_POLICY,
+    "get_courses_by_student": COURSE_POLICY,
+    "get_students_by_course": USER_POLICY,
+    "get_course_assignments": ObservationPolicy(max_items=50, max_depth=1, max_string_chars=300),
+    # 学生作业带有展开的作业信息(标题、截止时间等)，需要保留第二层
+    "get_student_assignments": ObservationPolicy(max_items=50, max_string_chars=300),
+}
+DEFAULT_POLICY = ObservationPolicy()
+
+
+class ShapedObservation(BaseModel):
+    """
+    A tool result ready to be inlined into the prompt.
+    """
+    text: str = Field(..., description="The observation text.")
+    raw_tokens: int = Field(..., description="Estimated tokens of the unshaped result.")
+    tokens: int = Field(..., description="Estimated tokens of the observation text.")
+    truncated: bool = Field(False, description="Whether the text was cut to the caps.")
+    summarized: bool = Field(False, description="Whether the text is an LLM summary of the result.")
+
+
+def _is_google_results(value: Any) -> bool:
+    return isinstance(value, dict) and (value.get("kind") == "customsearch#search" or "searchInformation" in value)
+
+
+def _project_google_results(value: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Keeps the title, link and snippet of each Google Custom Search result, dropping the request metadata."""
+    return [
+        {"title": item.get("title"), "link": item.get("link"), "snippet": item.get("snippet")}
+        for item in value.get("items", [])
+    ]
+
+
+# 已知结果类型的投影：(判断函数, 投影函数)
+_PROJECTIONS = [
+    (_is_google_results, _project_google_results),
+]
+
+
+def _select_fields(value: Any, fields: List[str]) -> Any:
+    if isinstance(value, dict):
+        return {key: value[key] for key in fields if key in value}
+    if isinstance(value, list):
+        return [_select_fields(item, fields) if isinstance(item, dict) else item for item in value]
+    return value
+
+
+def _limit(value: Any, policy: ObservationPolicy, depth: int = 0) -> Any:
+    """Caps list lengths, string lengths and nesting depth of a structured result."""
+    if isinstance(value, dict):
+        if depth > 0 and depth >= policy.max_depth:
+            reference = {key: value[key] for key in _REFERENCE_KEYS if key in value}
+            return reference or "{...}"
+        return {key: _limit(item, policy, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_limit(item, policy, depth) for item in value[:policy.max_items]]
+        if len(value) > policy.max_items:
+            items.append(f"...({len(value) - policy.max_items} more items omitted)")
+        return items
+    if isinstance(value, str) and depth > 0 and len(value) > policy.max_string_chars:
+        return value[:policy.max_string_chars] + f"...({len(value) - policy.max_string_chars} more characters)"
+    return value
+
+
+def _over_caps(text: str, policy: ObservationPolicy) -> bool:
+    return estimate_tokens(text) > policy.max_tokens or len(text.encode("utf-8")) > policy.max_bytes
+
+
+def _truncate(text: str, policy: ObservationPolicy) -> str:
+    text = truncate_to_tokens(text, policy.max_tokens)
+    return text.encode("utf-8")[:policy.max_bytes].decode("utf-8", "ignore")
+
+
+def shape_observation(tool_name: str, result: Any,
+                      summarizer: Optional[Callable[[str, str, int], Optional[str]]] = None) -> ShapedObservation:
+    """
+    Turns a tool result into a compact observation, so prompts stay small on multi-step runs.
+
+    Structured results (and strings holding JSON) are projected first: known result types such as Google
+    search responses are reduced to their useful fields, the policy's fields are selected from each record,
+    and long lists, long strings and deep nesting are cut. The result is serialized as compact JSON.
+    If it is still over the token or byte cap, it is summarized by `summarizer` when the policy allows,
+    and otherwise truncated with a marker saying how much was left out.
+
+    Args:
+        tool_name (str): The tool that produced the result; selects the ObservationPolicy.
+        result (Any): The tool result.
+        summarizer (Callable, optional): Called with (tool_name, text, max_tokens); returns a summary,
+            or None to fall back to truncation.
+
+    Returns:
+        ShapedObservation: The observation text and what was done to it.
+    """
+    policy = OBSERVATION_POLICIES.get(tool_name, DEFAULT_POLICY)
+    raw_text = str(result)
+    raw_tokens = estimate_tokens(raw_text)
+
+    value = result
+    if isinstance(value, str) and value.lstrip()[:1] in ("{", "["):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    if isinstance(value, (dict, list, tuple)):
+        for matches, project in _PROJECTIONS:
+            if matches(value):
+                value = project(value)
+                break
+        if policy.fields:
+            value = _select_fields(value, policy.fields)
+        text = json.dumps(_limit(value, policy), ensure_ascii=False, default=str, separators=(",", ":"))
+    else:
+        text = raw_text
+
+    truncated = summarized = False
+    if _over_caps(text, policy):
+        summarize = OBSERVATION_SUMMARIZE if policy.summarize is None else policy.summarize
+        if summarize and summarizer is not None:
+            try:
+                summary = summarizer(tool_name, truncate_to_tokens(text, SUMMARY_INPUT_TOKENS), policy.max_tokens)
+            except Exception as e:
+                logger.error(f"Error summarizing observation from {tool_name}: {e}")
+                summary = None
+            if summary:
+                text, summarized = summary, True
+        if _over_caps(text, policy):
+            total = estimate_tokens(text)
+            text = _truncate(text, policy)
+            text += f"\n...(truncated: about {estimate_tokens(text)} of {total} tokens shown)"
+            truncated = True
+
+    return ShapedObservation(text=text, raw_tokens=raw_tokens, tokens=estimate_tokens(text),
+                             truncated=truncated, summarized=summarized)
+
+
+def build_summary_prompt(tool_name: str, query: str, text: str, max_tokens: int) -> str:
+    """
+    Builds the prompt asking the LLM to summarize an over-cap observation for the user's question.
+
+    Args:
+        tool_name (str): The tool that produced the observation.
+        query (str): The user's question.
+        text (str): The observation to summarize.
+        max_tokens (int): The length the summary should stay within.
+
+    Returns:
+        str: The prompt.
+    """
+    return SUMMARY_PROMPT.format(tool=tool_name, max_tokens=max_tokens, query=query, observation=text)
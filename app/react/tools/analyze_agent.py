@@ -3,9 +3,9 @@ from pydantic_ai import Agent
 from pydantic_ai.models.openai import OpenAIModel
 from pydantic_ai.providers.deepseek import DeepSeekProvider
 from pydantic_ai.providers.openai import OpenAIProvider
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List
 
-import os
 import pandas as pd
 import peewee
 from flask import session
@@ -16,7 +16,8 @@ from app.models.user import User
 from app.models.course import Course
 from app.models.assignment import Assignment, StudentAssignment
 from app.react.tools_register import register_as_tool
-from app.utils.io import write_to_file
+from app.utils.trace_writer import get_trace_writer
+from app.utils.llm.client import get_client
 
 
 OUTPUT_TRACE_PATH = "./data/analytics/trace.txt"
@@ -40,12 +41,14 @@ df = None
 
 @dataclass
 class Deps:
-    """The only dependency we need is the DataFrame we'll be working with."""
+    """The DataFrame we'll be working with, and the trace lines of the current question."""
     df: pd.DataFrame
+    trace: List[str] = field(default_factory=list)
 
 model = OpenAIModel(
     'deepseek-chat',
-    provider=DeepSeekProvider(api_key=os.getenv('DEEPSEEK_API_KEY')),
+    # 与ReAct Agent共用同一个DeepSeek客户端的并发上限和重试策略
+    provider=DeepSeekProvider(openai_client=get_client('deepseek').async_openai()),
     #'gpt-4-turbo', 
     #provider=OpenAIProvider(api_key=os.getenv('OPENAI_API_KEY'))
 )
@@ -77,25 +80,30 @@ async def df_query(ctx: RunContext[Deps], query: str) -> str:
     """
 
     # Print the query for debugging purposes and fun :)
-    write_to_file(OUTPUT_TRACE_PATH, f'Running query: `{query}`\n')
+    ctx.deps.trace.append(f'Running query: `{query}`\n')
     try:
         # Execute the query using `pd.eval` and return the result as a string (must be serializable).
-        write_to_file(OUTPUT_TRACE_PATH, f"Query result: \n{str(pd.eval(query, target=ctx.deps.df))}\n")
-        return str(pd.eval(query, target=ctx.deps.df))
+        result = str(pd.eval(query, target=ctx.deps.df))
+        ctx.deps.trace.append(f"Query result: \n{result}\n")
+        return result
     except Exception as e:
         #  On error, raise a `ModelRetry` exception with feedback for the agent.
-        write_to_file(OUTPUT_TRACE_PATH, f"Query error: {e}\n")
+        ctx.deps.trace.append(f"Query error: {e}\n")
         raise ModelRetry(f'query: `{query}` is not a valid query. Reason: `{e}`') from e
 
 
 def ask_agent(question, df):
     """Function to ask questions to the agent and display the response"""
     deps = Deps(df=df)
-    write_to_file(OUTPUT_TRACE_PATH, f"Question: {question}\n")
-    result = agent.run_sync(question, deps=deps)
-    #print(f"Answer: {response.new_messages()[-1].content}")
-    write_to_file(OUTPUT_TRACE_PATH, f"Answer: {result.data}\n")
-    write_to_file(OUTPUT_TRACE_PATH, '-'*50 + '\n')
+    deps.trace.append(f"Question: {question}\n")
+    try:
+        result = agent.run_sync(question, deps=deps)
+        #print(f"Answer: {response.new_messages()[-1].content}")
+        deps.trace.append(f"Answer: {result.data}\n")
+    finally:
+        # 每个问题的轨迹作为一条记录写入，并发的分析任务不会交错
+        deps.trace.append('-'*50 + '\n')
+        get_trace_writer(OUTPUT_TRACE_PATH).write("".join(deps.trace))
     return result.data
 
 
@@ -3,13 +3,12 @@ import functools
 
 import json
 
-from typing import Dict, Any, Callable, List, Type, Union, get_type_hints, get_origin, get_args
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple, Type, get_type_hints, get_origin, get_args
 from datetime import datetime, date
 from flask import jsonify, Response
+from peewee import ModelSelect
 from app.utils.logging import logger
 from app.models.base import BaseModel
-from app.models.user import User
-from playhouse.shortcuts import model_to_dict
 
 class ToolExecutionError(Exception):
     """Exception raised when a tool execution fails."""
@@ -23,40 +22,129 @@ student_tools = {}
 teacher_tools = {}
 admin_tools = {}
 
-def clean_datetime_fields(data: Union[Dict, List, Any]) -> Union[Dict, List, Any]:
-    """Recursively remove 'created_at' and 'updated_at' fields from dictionaries.
-    
+# Prompt-ready tool catalogue of each role, rebuilt when a tool is registered
+tool_catalogues = {"student": "", "teacher": "", "admin": ""}
+
+def format_tool_catalogue(tools: Dict[str, Any]) -> str:
+    """Format tool names and descriptions for the agent prompt.
+
     Args:
-        data: The data structure to clean, can be a dictionary, list, or other value.
-        
+        tools: A mapping of tool name to a dict (or object) with a description.
+
     Returns:
-        The cleaned data structure with datetime fields removed.
+        The catalogue string inserted into the {tools} placeholder of the prompt template.
+    """
+    return '\n\n'.join([
+        f"{str(name)}: \n \'\'\'{tool['description'] if isinstance(tool, dict) else tool.description}\n\'\'\'"
+        for name, tool in tools.items()
+    ])
+
+def get_tool_catalogue(role: str) -> str:
+    """Return the precomputed tool catalogue of a role; unknown roles get the admin catalogue."""
+    return tool_catalogues.get(role, tool_catalogues["admin"])
+
+# Columns never included in tool results: timestamps are noise for the agent, password hashes are secret
+EXCLUDED_FIELDS = ('created_at', 'updated_at', 'password_hash')
+
+class ModelSerializer:
+    """Turns rows of one peewee model into dicts with a fixed field projection.
+
+    The projection is resolved once per model (see get_serializer), so serializing a row is a plain
+    lookup of each projected column in the row's loaded data. Foreign keys are emitted as the raw id,
+    exactly as stored on the row, and are never fetched lazily. Foreign keys listed in `expand` are
+    replaced by the serialized related row: rows already joined by the tool's query are reused, and the
+    remaining related rows of a whole result are fetched in one query.
     """
-    if isinstance(data, dict):
-        # Create a new dict without datetime fields
-        cleaned_dict = {}
-        for key, value in data.items():
-            # Skip created_at and updated_at fields
-            if key in ('created_at', 'updated_at'):
-                continue
-            # Recursively clean nested structures
-            cleaned_dict[key] = clean_datetime_fields(value)
-        return cleaned_dict
-    elif isinstance(data, list):
-        # Recursively clean each item in the list
-        return [clean_datetime_fields(item) for item in data]
-    else:
-        # Return non-dict, non-list values as is
+
+    def __init__(self, model: Type[BaseModel], fields: Optional[Iterable[str]] = None,
+                 expand: Iterable[str] = ()):
+        """
+        Args:
+            model: The peewee model.
+            fields: The fields to include. Defaults to every field except EXCLUDED_FIELDS.
+                The primary key is always included.
+            expand: Foreign key fields to replace by the related row.
+        """
+        meta = model._meta
+        names = list(fields) if fields is not None else [
+            name for name in meta.sorted_field_names if name not in EXCLUDED_FIELDS
+        ]
+        if meta.primary_key.name not in names:
+            names.insert(0, meta.primary_key.name)
+        self.model = model
+        self.names = names
+        self.columns = [meta.fields[name] for name in names]
+        self.expand = [(meta.fields[name], get_serializer(meta.fields[name].rel_model)) for name in expand]
+
+    def serialize_rows(self, rows: List[BaseModel]) -> List[Dict[str, Any]]:
+        """Serialize model instances that have already been fetched, without further queries except expansions."""
+        names = self.names
+        return self._expand([{name: row.__data__.get(name) for name in names} for row in rows], rows)
+
+    def serialize_query(self, query: ModelSelect) -> List[Dict[str, Any]]:
+        """Run a query selecting only the projected columns and serialize its rows."""
+        return self._expand(list(query.select(*self.columns).dicts()))
+
+    def _expand(self, data: List[Dict[str, Any]], rows: Optional[List[BaseModel]] = None) -> List[Dict[str, Any]]:
+        for field, serializer in self.expand:
+            key = field.rel_field.name
+            related = {}
+            if rows is not None:
+                # 查询时已经join的关联行直接使用，不再查询
+                joined = {}
+                for row in rows:
+                    instance = row.__rel__.get(field.name)
+                    if instance is not None:
+                        joined[instance.__data__.get(key)] = instance
+                related = {item[key]: item for item in serializer.serialize_rows(list(joined.values()))}
+            missing = {item[field.name] for item in data if item.get(field.name) is not None} - related.keys()
+            if missing:
+                query = field.rel_model.select().where(field.rel_field.in_(list(missing)))
+                related.update({item[key]: item for item in serializer.serialize_query(query)})
+            for item in data:
+                item[field.name] = related.get(item[field.name], item[field.name])
         return data
 
-def model_to_dict_cleaned(model):
-    return clean_datetime_fields(model_to_dict(model, exclude=[User.password_hash]))
+# Serializers compiled so far, keyed by (model, fields, expand)
+_serializers: Dict[Tuple, ModelSerializer] = {}
+
+def get_serializer(model: Type[BaseModel], fields: Optional[Iterable[str]] = None,
+                   expand: Iterable[str] = ()) -> ModelSerializer:
+    """Return the serializer of a model and projection, compiling it on first use."""
+    key = (model, tuple(fields) if fields is not None else None, tuple(expand))
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = _serializers.setdefault(key, ModelSerializer(model, fields, expand))
+    return serializer
+
+def serialize_result(results: Any, expand: Iterable[str] = ()) -> Any:
+    """Convert a tool result made of peewee models into plain dicts.
+
+    Args:
+        results: A model instance, a list of instances, an unexecuted select query, or any other value.
+        expand: Foreign key fields of the result's model to replace by the related row.
 
-def create_tool_executor(func: Callable) -> Callable:
+    Returns:
+        A dict for an instance, a list of dicts for a list or a query, other values unchanged.
+    """
+    if isinstance(results, BaseModel):
+        return get_serializer(type(results), expand=expand).serialize_rows([results])[0]
+    if isinstance(results, ModelSelect):
+        # 查询尚未执行时只选择需要的列
+        return get_serializer(results.model, expand=expand).serialize_query(results)
+    if isinstance(results, list) and results and all(isinstance(result, BaseModel) for result in results):
+        model = type(results[0])
+        if all(type(result) is model for result in results):
+            return get_serializer(model, expand=expand).serialize_rows(results)
+        return [serialize_result(result) for result in results]
+    return results
+
+def create_tool_executor(func: Callable, expand: Iterable[str] = ()) -> Callable:
     """Create a function that executes a service method with JSON/Dict parameters.
     
     Args:
         func: The function to execute
+        expand: Foreign key fields of returned models to include as nested rows
         
     Returns:
         A function that accepts JSON/Dict and calls the service method
@@ -68,14 +156,8 @@ def create_tool_executor(func: Callable) -> Callable:
         # Call the method
         try:
             results = func(**params)
-            # 如果返回的是BaseModel，则转换为字典
-            if isinstance(results, BaseModel):
-                return model_to_dict_cleaned(results)
-            # 如果返回的是列表，则转换为字典列表
-            elif isinstance(results, list):
-                return [model_to_dict_cleaned(result) for result in results]
-            # 如果返回的是其他类型，则直接返回
-            return results
+            # 模型、模型列表和查询转换为字典，其他类型直接返回
+            return serialize_result(results, expand)
         except Exception as e:
             logger.exception(f"Error executing {func.__name__}")
             raise ToolExecutionError(f"Error executing {func.__name__}: {str(e)}", original_error=e)
@@ -83,7 +165,7 @@ def create_tool_executor(func: Callable) -> Callable:
     return executor
 
 
-def _register_tool(func: Callable, tools: Dict[str, Any]):
+def _register_tool(func: Callable, tools: Dict[str, Any], expand: Iterable[str] = ()):
     """Register a function to the tool registry."""
     signature = inspect.signature(func)
     docstring = inspect.getdoc(func) or ""
@@ -93,7 +175,7 @@ def _register_tool(func: Callable, tools: Dict[str, Any]):
 
     # Register the tool with metadata
     tools[func.__name__] = {
-        "function": create_tool_executor(actual_func),
+        "function": create_tool_executor(actual_func, expand),
         "description": docstring,
         "parameters": {
             name: {
@@ -104,9 +186,14 @@ def _register_tool(func: Callable, tools: Dict[str, Any]):
         }
     }
 
-def register_as_tool(roles: List[str]) -> Callable:
+def register_as_tool(roles: List[str], expand: Iterable[str] = ()) -> Callable:
     """Register a function as a tool for the ReAct agent.
 
+    Args:
+        roles: The roles that may use the tool; admin can always use it.
+        expand: Foreign key fields of the returned models to include as nested rows instead of ids,
+            e.g. ["teacher"] for a tool returning courses.
+
     Returns:
         object: 
     """
@@ -117,13 +204,16 @@ def register_as_tool(roles: List[str]) -> Callable:
             return func(*args, **kwargs)
         
         if "student" in roles:
-            _register_tool(func, student_tools)
+            _register_tool(func, student_tools, expand)
+            tool_catalogues["student"] = format_tool_catalogue(student_tools)
             logger.info(f"tool registered: {func.__name__} for student")
         if "teacher" in roles:
-            _register_tool(func, teacher_tools)
+            _register_tool(func, teacher_tools, expand)
+            tool_catalogues["teacher"] = format_tool_catalogue(teacher_tools)
             logger.info(f"tool registered: {func.__name__} for teacher")
         # admin can use all tools
-        _register_tool(func, admin_tools)
+        _register_tool(func, admin_tools, expand)
+        tool_catalogues["admin"] = format_tool_catalogue(admin_tools)
         
         return wrapper
     
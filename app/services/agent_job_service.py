@@ -0,0 +1,80 @@
+import os
+
+from flask import copy_current_request_context, has_request_context
+
+from app.ext import db
+from app.utils.job_queue import JobQueue
+
+# 同时运行的agent任务数、等待中的任务上限、每个用户同时进行的任务上限
+AGENT_JOB_WORKERS = int(os.getenv("AGENT_JOB_WORKERS") or 4)
+AGENT_JOB_MAX_QUEUED = int(os.getenv("AGENT_JOB_MAX_QUEUED") or 32)
+AGENT_JOB_PER_USER = int(os.getenv("AGENT_JOB_PER_USER") or 2)
+# 已完成任务的结果保留时间(秒)
+AGENT_JOB_RETENTION = int(os.getenv("AGENT_JOB_RETENTION") or 600)
+
+# 任务队列位于进程内存中：多进程部署时任务只能从提交它的进程查询，各项上限也按进程计算，
+# 因此需要单进程(多线程)运行，或将同一用户的请求固定路由到同一进程
+agent_jobs = JobQueue(
+    max_workers=AGENT_JOB_WORKERS,
+    max_queued=AGENT_JOB_MAX_QUEUED,
+    per_owner_limit=AGENT_JOB_PER_USER,
+    retention=AGENT_JOB_RETENTION
+)
+
+
+class AgentJobService:
+    # Agent任务服务类：聊天、资源推荐和学情分析等耗时的agent调用在后台工作线程中运行，不占用请求线程
+
+    @staticmethod
+    def submit(kind, user_id, func, *args, **kwargs):
+        """提交一个agent任务。
+
+        func(job, *args, **kwargs)在工作线程中运行，可以通过job.publish推送进度事件，返回值作为任务结果。
+        在请求中提交时会复制请求上下文，任务中仍可以读取session；任务结束后归还数据库连接。
+
+        Args:
+            kind (str): 任务类型，如"chat"、"recommend"、"analysis"
+            user_id (int): 提交任务的用户ID，用于每用户并发限制和结果访问权限
+            func (Callable): 任务函数
+
+        Returns:
+            Job: 排队中的任务
+
+        Raises:
+            JobRejected: 队列已满或该用户进行中的任务过多
+        """
+        def task(job, *task_args, **task_kwargs):
+            try:
+                return func(job, *task_args, **task_kwargs)
+            finally:
+                db.close()
+
+        if has_request_context():
+            task = copy_current_request_context(task)
+        return agent_jobs.submit(kind, user_id, task, *args, **kwargs)
+
+    @staticmethod
+    def get_job(job_id, user_id):
+        """获取属于指定用户的任务。
+
+        Args:
+            job_id (str): 任务ID
+            user_id (int): 用户ID
+
+        Returns:
+            Job: 任务，不存在、已过期或不属于该用户时返回None
+        """
+        job = agent_jobs.get(job_id)
+        if job is None or job.owner != user_id:
+            return None
+        return job
+
+    @staticmethod
+    def stats():
+        """获取任务队列的使用情况"""
+        return agent_jobs.stats()
+
+    @staticmethod
+    def rejection_response(error):
+        """将JobRejected转换为(响应体, 状态码)：用户任务过多返回429，队列已满返回503"""
+        return {'error': str(error), 'reason': error.reason}, (429 if error.reason == "user_limit" else 503)
@@ -145,7 +145,7 @@ class AssignmentService:
         student_assignment.save()
         return student_assignment
     
-    @register_as_tool(roles=["student", "teacher"])
+    @register_as_tool(roles=["student", "teacher"], expand=["assignment"])
     @staticmethod
     def get_student_assignments(student_id, course_id=None,completed=None):
         """
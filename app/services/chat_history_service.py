@@ -0,0 +1,130 @@
+import threading
+
+from app.ext import db
+from app.models.chat import Chat, ChatMessage
+from app.utils.llm.client import get_client
+from app.utils.logging import logger
+from app.utils.tokens import estimate_tokens
+
+# 放入提示词的近期对话的token预算
+HISTORY_TOKEN_BUDGET = 2000
+# 摘要的目标长度(token)
+SUMMARY_TOKEN_BUDGET = 500
+
+SUMMARY_PROMPT = """你负责维护一段师生学习助手对话的滚动摘要。
+请将"已有摘要"与"新增对话"合并为一份新的摘要，保留用户的身份、学习目标、提到的课程和知识点、已经得出的结论以及尚未解决的问题，
+省略寒暄和重复内容。摘要使用中文，不超过{limit}字，只输出摘要本身。
+
+已有摘要:
+{summary}
+
+新增对话:
+{turns}
+"""
+
+# 正在生成摘要的会话ID，避免同一会话并发生成摘要
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+class ChatHistoryService:
+    # 聊天历史服务类：为Agent构造有界的对话历史，并维护会话的滚动摘要
+
+    @staticmethod
+    def _unsummarized(chat):
+        """按时间倒序查询尚未并入摘要的消息"""
+        return (ChatMessage
+                .select()
+                .where((ChatMessage.chat == chat) & (ChatMessage.id > chat.summary_until))
+                .order_by(ChatMessage.timestamp.desc()))
+
+    @staticmethod
+    def _split_window(messages, token_budget):
+        """将倒序的消息分为窗口内(正序)和窗口外(正序)两部分，窗口至少包含最新的一条消息"""
+        window, used = [], 0
+        for index, message in enumerate(messages):
+            used += estimate_tokens(message.content)
+            if window and used > token_budget:
+                return list(reversed(window)), list(reversed(messages[index:]))
+            window.append(message)
+        return list(reversed(window)), []
+
+    @staticmethod
+    def get_history(chat, token_budget=HISTORY_TOKEN_BUDGET, exclude_message_id=None):
+        """获取用于Agent提示词的对话历史：滚动摘要加上token预算内的近期消息。
+
+        Args:
+            chat (Chat): 聊天会话
+            token_budget (int): 近期消息的token预算
+            exclude_message_id (int, optional): 不放入历史的消息ID，通常是本轮的用户消息，它会作为query传入
+
+        Returns:
+            list: 按时间正序的消息列表，每项都有role和content属性；有摘要时第一项为system消息
+        """
+        messages = [message for message in ChatHistoryService._unsummarized(chat)
+                    if message.id != exclude_message_id]
+        window, _ = ChatHistoryService._split_window(messages, token_budget)
+        if chat.summary:
+            window.insert(0, ChatMessage(role=ChatMessage.ROLE_SYSTEM, content=f"此前对话的摘要: {chat.summary}"))
+        return window
+
+    @staticmethod
+    def update_summary(chat_id, token_budget=HISTORY_TOKEN_BUDGET):
+        """将滑出历史窗口的消息增量并入会话摘要。
+
+        只把上次摘要之后、且已不在窗口内的消息与已有摘要一起交给LLM，所以每次的摘要开销与会话总长度无关。
+
+        Args:
+            chat_id (int): 聊天会话ID
+            token_budget (int): 近期消息的token预算，应与get_history一致
+
+        Returns:
+            bool: 摘要是否被更新
+        """
+        chat = Chat.get_or_none(Chat.id == chat_id)
+        if not chat:
+            return False
+        _, overflow = ChatHistoryService._split_window(list(ChatHistoryService._unsummarized(chat)), token_budget)
+        if not overflow:
+            return False
+
+        turns = "\n".join(f"{message.role}: {message.content}" for message in overflow)
+        summary = get_client().chat([{
+            "role": "user",
+            "content": SUMMARY_PROMPT.format(limit=SUMMARY_TOKEN_BUDGET, summary=chat.summary or "(无)", turns=turns)
+        }])
+        if not summary:
+            # 摘要失败时保留原状态，下次再并入
+            logger.warning(f"Failed to summarize chat {chat_id}")
+            return False
+
+        # 只更新摘要字段，并以旧的水位线为条件，避免覆盖并发写入的标题或更新的摘要
+        updated = (Chat
+                   .update(summary=summary.strip(), summary_until=overflow[-1].id)
+                   .where((Chat.id == chat_id) & (Chat.summary_until == chat.summary_until))
+                   .execute())
+        return updated > 0
+
+    @staticmethod
+    def schedule_summary(chat_id):
+        """在后台线程中更新会话摘要，不阻塞当前请求。同一会话已在生成摘要时直接跳过。
+
+        Args:
+            chat_id (int): 聊天会话ID
+        """
+        with _summarizing_lock:
+            if chat_id in _summarizing:
+                return
+            _summarizing.add(chat_id)
+
+        def worker():
+            try:
+                ChatHistoryService.update_summary(chat_id)
+            except Exception as e:
+                logger.error(f"Error updating summary of chat {chat_id}: {e}")
+            finally:
+                db.close()
+                with _summarizing_lock:
+                    _summarizing.discard(chat_id)
+
+        threading.Thread(target=worker, daemon=True).start()
@@ -98,7 +98,7 @@ class CourseService:
 
         return student_course.delete_instance()
 
-    @register_as_tool(roles=["student", "teacher"])
+    @register_as_tool(roles=["student", "teacher"], expand=["teacher"])
     @staticmethod
     def get_all_courses():
         """获取所有的课程
@@ -121,7 +121,7 @@ class CourseService:
         """
         return list(Course.select().where(Course.teacher_id == teacher_id))
     
-    @register_as_tool(roles=["student", "teacher"])
+    @register_as_tool(roles=["student", "teacher"], expand=["teacher"])
     @staticmethod
     def get_courses_by_student(student_id):
         """获取学生所参与的所有课程。
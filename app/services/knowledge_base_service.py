@@ -1,12 +1,246 @@
 from app.models.knowledge_base import KnowledgeBase
-from app.ext import knowledge_base_collection
+from app.models.course import Course
+from peewee import JOIN
+from app.ext import db, knowledge_base_collection, embedding_cache, embedding_function
+from app.utils.chunking import split_into_chunks
+from app.utils.embedding_cache import normalize_content
+from app.utils.lexical_index import LexicalIndex
+from app.utils.logging import logger
+from app.utils.query_cache import QueryCache
+from app.react.tools_register import register_as_tool
+from concurrent.futures import ThreadPoolExecutor, wait
+import json
+import os
+import threading
 import uuid
 
+
+# 回填模式下每轮扩大检索数量的倍数
+BACKFILL_FACTOR = 2
+# 扩大检索时每个查询的检索数量上限，避免在大集合上无限扩大
+MAX_SEARCH_RESULTS = 200
+
+# 每个标签在元数据中存为一个布尔键，以便在where条件中按标签筛选
+TAG_KEY_PREFIX = "tag:"
+
+# 长内容按段落切分后分别嵌入，每块的最大字符数和相邻块的重叠字符数
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 50
+
+# 混合检索整个调用的时间预算(秒)，超时的一路不参与融合
+HYBRID_TIMEOUT = 2.0
+
+# 倒数排名融合(RRF)的平滑常数
+RRF_K = 60
+
+# 表示参数未传入，用于区分"不修改"和"设为None"
+_UNSET = object()
+
+# 搜索结果缓存。缓存键包含知识库版本号，增删改时版本号加一，旧结果不再命中并逐渐被淘汰。
+# 版本号位于进程内存中，多进程部署时其他进程的修改最多在TTL之后可见。
+SEARCH_CACHE_SIZE = 2048
+SEARCH_CACHE_TTL = 60
+search_cache = QueryCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+_knowledge_version = 0
+_knowledge_version_lock = threading.Lock()
+
+
+def _bump_version():
+    """知识库内容变化后使搜索结果缓存失效。"""
+    global _knowledge_version
+    with _knowledge_version_lock:
+        _knowledge_version += 1
+
+# 词法索引在第一次混合检索时由后台线程从数据库构建，之后随增删改同步更新。
+# 索引位于进程内存中，多进程部署时其他进程的修改要等到进程重启后才可见。
+_lexical_index = None
+# 构建期间的增删改先记录在这里，构建完成后重放到新索引再发布
+_lexical_pending = None
+# 正在构建索引的线程
+_lexical_build_thread = None
+# 保护_lexical_build_thread，保证同时只有一个构建线程
+_lexical_index_lock = threading.Lock()
+# 保护_lexical_pending和索引的发布
+_lexical_pending_lock = threading.Lock()
+
+# 向量检索和词法检索使用各自的线程池，一路积压不会让另一路排队
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="knowledge-search")
+_lexical_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="knowledge-lexical")
+
+
+def _embed(texts):
+    """计算文本的嵌入向量，已缓存的内容不会重新计算。"""
+    return embedding_cache.embed(texts, embedding_function)
+
+
+def _build_metadata(knowledge_id, title, course_id=None, category=None, tags=None):
+    """构建写入ChromaDB的元数据。"""
+    metadata = {
+        "id": knowledge_id,
+        "title": title,
+        "category": category or "",
+        "course_id": int(course_id) if course_id else 0,
+        "tags": ",".join(tags) if tags else ""
+    }
+    for tag in tags or []:
+        metadata[TAG_KEY_PREFIX + tag] = True
+    return metadata
+
+
+def _build_chunks(vector_id, knowledge_id, title, content, course_id=None, category=None, tags=None):
+    """将知识条目切分为向量数据库中的多个块。
+    
+    第一块使用条目的vector_id作为ID，其余块使用"<vector_id>#<序号>"。
+    每块的元数据都带有所属条目的id和vector_id，检索时据此合并回条目。
+    
+    Returns:
+        tuple: (ids, documents, metadatas)
+    """
+    documents = split_into_chunks(content, CHUNK_SIZE, CHUNK_OVERLAP)
+    ids = [vector_id] + [f"{vector_id}#{i}" for i in range(1, len(documents))]
+    metadatas = []
+    for i in range(len(documents)):
+        metadata = _build_metadata(knowledge_id, title, course_id, category, tags)
+        metadata["vector_id"] = vector_id
+        metadata["chunk"] = i
+        metadatas.append(metadata)
+    return ids, documents, metadatas
+
+
+def _get_chunk_ids(vector_id):
+    """获取条目在向量数据库中的全部块ID，兼容未分块的旧条目。"""
+    ids = set(knowledge_base_collection.get(where={"vector_id": vector_id}, include=[])["ids"])
+    ids.update(knowledge_base_collection.get(ids=[vector_id], include=[])["ids"])
+    return ids
+
+
+def _build_where(course_id=None, category=None, tags=None):
+    """将筛选条件编译为ChromaDB的where条件，没有条件时返回None。"""
+    conditions = []
+    if course_id is not None:
+        conditions.append({"course_id": int(course_id)})
+    if category:
+        conditions.append({"category": category})
+    for tag in tags or []:
+        conditions.append({TAG_KEY_PREFIX + tag: True})
+    
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def _lexical_entry(knowledge_id, title, content, course_id=None, category=None, tags=None):
+    """生成知识条目在词法索引中的文本和字段，标题重复一次以提高标题命中的权重。"""
+    text = "\n".join([title, title, " ".join(tags or []), content])
+    return text, {
+        "id": knowledge_id,
+        "title": title,
+        # 只保留第一块作为摘要，避免返回整篇内容
+        "content": split_into_chunks(content, CHUNK_SIZE, CHUNK_OVERLAP)[0],
+        "distance": None,
+        "category": category or "",
+        "course_id": int(course_id) if course_id else 0,
+        "tags": list(tags or []),
+        "chunk": 0
+    }
+
+
+def _update_lexical(knowledge_id, entry=None):
+    """将知识条目写入(entry为None时移除)词法索引；索引正在构建时记录下来，构建完成后重放。"""
+    with _lexical_pending_lock:
+        if _lexical_pending is not None:
+            _lexical_pending.append((knowledge_id, entry))
+            return
+        index = _lexical_index
+    if index is None:
+        return
+    if entry is None:
+        index.remove(knowledge_id)
+    else:
+        index.add(knowledge_id, *entry)
+
+
+def _index_lexical(knowledge_id, title, content, course_id=None, category=None, tags=None):
+    """将知识条目写入词法索引。"""
+    if _lexical_index is None and _lexical_pending is None:
+        return
+    _update_lexical(knowledge_id, _lexical_entry(knowledge_id, title, content, course_id, category, tags))
+
+
+def _build_lexical_index():
+    """从数据库构建词法索引，在后台线程中运行。
+
+    索引在局部变量中构建完成后才发布，并发的检索不会用到构建了一半的索引；构建失败时不发布，
+    下次检索时重新构建。构建期间的增删改记录在_lexical_pending中，发布前重放，不会丢失。
+    """
+    global _lexical_index, _lexical_pending
+    try:
+        index = LexicalIndex()
+        query = KnowledgeBase.select(
+            KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.content,
+            KnowledgeBase.course, KnowledgeBase.category, KnowledgeBase.tags
+        )
+        for knowledge in query.iterator():
+            index.add(knowledge.id, *_lexical_entry(
+                knowledge.id, knowledge.title, knowledge.content,
+                knowledge.course_id, knowledge.category, knowledge.tags))
+    except Exception:
+        with _lexical_pending_lock:
+            _lexical_pending = None
+        logger.exception("Error building lexical index")
+        return
+    finally:
+        db.close()
+    with _lexical_pending_lock:
+        for knowledge_id, entry in _lexical_pending:
+            if entry is None:
+                index.remove(knowledge_id)
+            else:
+                index.add(knowledge_id, *entry)
+        _lexical_pending = None
+        _lexical_index = index
+    logger.info(f"Lexical index built with {len(index)} entries")
+
+
+def _get_lexical_index():
+    """获取词法索引。尚未构建时在后台线程中开始构建并返回None，不阻塞检索。"""
+    global _lexical_build_thread, _lexical_pending
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None and (_lexical_build_thread is None or not _lexical_build_thread.is_alive()):
+                # 在查询数据库之前开始记录增删改
+                with _lexical_pending_lock:
+                    _lexical_pending = []
+                _lexical_build_thread = threading.Thread(
+                    target=_build_lexical_index, name="lexical-index-build", daemon=True)
+                _lexical_build_thread.start()
+    return _lexical_index
+
+
+def _load_checkpoint(path):
+    """读取批量导入的断点文件，不存在时返回初始状态。"""
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    return {"next_index": 0, "pending": None}
+
+
+def _save_checkpoint(path, checkpoint):
+    """原子地写入断点文件，避免进程崩溃时留下半个文件。"""
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
 class KnowledgeBaseService:
     """知识库服务, 处理FAQ和知识内容的存储、检索。
     
     该服务提供知识库相关功能，包括添加知识条目、向量化存储和检索等。
-    使用ChromaDB进行向量存储和语义检索。
+    使用ChromaDB进行向量存储和语义检索。长内容切分为多个块分别存储，检索时合并回所属条目。
     """
     
     @staticmethod
@@ -23,68 +257,446 @@ class KnowledgeBaseService:
         Returns:
             KnowledgeBase: 创建的知识条目对象
         """
-        # 创建数据库记录
+        # 预先生成向量ID，一次写入数据库记录
+        vector_id = str(uuid.uuid4())
         knowledge = KnowledgeBase.create(
             title=title,
             content=content,
             course_id=course_id,
             category=category,
-            tags=tags
+            tags=tags,
+            vector_id=vector_id
         )
         
-        # 生成唯一ID
-        vector_id = str(uuid.uuid4())
-        knowledge.vector_id = vector_id
-        knowledge.save()
-        
-        # 添加到向量数据库
+        # 分块添加到向量数据库
+        ids, documents, metadatas = _build_chunks(vector_id, knowledge.id, title, content,
+                                                  course_id, category, tags)
         knowledge_base_collection.add(
-            ids=[vector_id],
-            documents=[content],
-            metadatas=[{
-                "id": knowledge.id,
-                "title": title,
-                "category": category or "",
-                "course_id": course_id or 0,
-                "tags": ",".join(tags) if tags else ""
-            }]
+            ids=ids,
+            embeddings=_embed(documents),
+            documents=documents,
+            metadatas=metadatas
         )
+        _index_lexical(knowledge.id, title, content, course_id, category, tags)
+        _bump_version()
         
         return knowledge
     
     @staticmethod
-    def search_knowledge(query, course_id=None, limit=5):
+    def bulk_add_knowledge(entries, batch_size=500, checkpoint_path=None):
+        """批量添加知识条目，适用于导入大规模课程语料。
+        
+        每个批次使用一次insert_many写入数据库，并用一次collection.add写入向量数据库。
+        指定checkpoint_path时，每个批次完成后记录进度；批次开始前先记录预生成的向量ID，
+        因此进程崩溃后重新执行会跳过已完成的批次，并复用未完成批次的向量ID，不会产生重复条目。
+        
+        Args:
+            entries (iterable): 知识条目字典，包含title、content，可选course_id、category、tags。
+                断点续传时需要保证每次传入的条目顺序一致。
+            batch_size (int): 每批写入的条目数量
+            checkpoint_path (str, optional): 断点文件路径
+            
+        Returns:
+            int: 本次调用新导入的条目数量
+        """
+        checkpoint = _load_checkpoint(checkpoint_path)
+        imported = 0
+        batch = []
+        start = 0
+        
+        for index, entry in enumerate(entries):
+            # 跳过已完成的批次
+            if index < checkpoint["next_index"]:
+                continue
+            if not batch:
+                start = index
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                imported += KnowledgeBaseService._import_batch(batch, start, checkpoint, checkpoint_path)
+                batch = []
+        
+        if batch:
+            imported += KnowledgeBaseService._import_batch(batch, start, checkpoint, checkpoint_path)
+        
+        return imported
+    
+    @staticmethod
+    def _import_batch(batch, start, checkpoint, checkpoint_path):
+        """导入一个批次并推进断点，返回新写入数据库的条目数量。"""
+        pending = checkpoint.get("pending")
+        if pending and pending["start"] == start and len(pending["vector_ids"]) == len(batch):
+            # 上次在该批次中途失败，复用相同的向量ID
+            vector_ids = pending["vector_ids"]
+        else:
+            vector_ids = [str(uuid.uuid4()) for _ in batch]
+            checkpoint["pending"] = {"start": start, "vector_ids": vector_ids}
+            _save_checkpoint(checkpoint_path, checkpoint)
+        
+        # 数据库中已存在的记录不再重复插入
+        id_by_vector_id = {
+            row.vector_id: row.id
+            for row in KnowledgeBase.select(KnowledgeBase.id, KnowledgeBase.vector_id)
+                                    .where(KnowledgeBase.vector_id.in_(vector_ids))
+        }
+        rows = [
+            {
+                "title": entry["title"],
+                "content": entry["content"],
+                "course": entry.get("course_id"),
+                "category": entry.get("category"),
+                "tags": entry.get("tags"),
+                "vector_id": vector_id
+            }
+            for entry, vector_id in zip(batch, vector_ids)
+            if vector_id not in id_by_vector_id
+        ]
+        if rows:
+            with db.atomic():
+                inserted = (KnowledgeBase
+                            .insert_many(rows)
+                            .returning(KnowledgeBase.id, KnowledgeBase.vector_id)
+                            .dicts()
+                            .execute())
+                for row in inserted:
+                    id_by_vector_id[row["vector_id"]] = row["id"]
+        
+        # 向量数据库中已存在的条目不再重复添加(同一条目的块在同一次add中写入)
+        indexed = set(knowledge_base_collection.get(ids=vector_ids, include=[])["ids"])
+        ids, documents, metadatas = [], [], []
+        for entry, vector_id in zip(batch, vector_ids):
+            if vector_id in indexed:
+                continue
+            chunk_ids, chunk_documents, chunk_metadatas = _build_chunks(
+                vector_id,
+                id_by_vector_id[vector_id],
+                entry["title"],
+                entry["content"],
+                entry.get("course_id"),
+                entry.get("category"),
+                entry.get("tags")
+            )
+            ids.extend(chunk_ids)
+            documents.extend(chunk_documents)
+            metadatas.extend(chunk_metadatas)
+        if ids:
+            knowledge_base_collection.add(
+                ids=ids,
+                embeddings=_embed(documents),
+                documents=documents,
+                metadatas=metadatas
+            )
+        for entry, vector_id in zip(batch, vector_ids):
+            _index_lexical(id_by_vector_id[vector_id], entry["title"], entry["content"],
+                           entry.get("course_id"), entry.get("category"), entry.get("tags"))
+        
+        _bump_version()
+        
+        checkpoint["next_index"] = start + len(batch)
+        checkpoint["pending"] = None
+        _save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(f"Imported knowledge entries {start}-{start + len(batch) - 1}")
+        
+        return len(rows)
+    
+    @staticmethod
+    def search_knowledge(query, course_id=None, limit=5, category=None, tags=None, backfill=False,
+                         include_record=True, hybrid=False):
         """搜索知识库。
         
+        课程、分类和标签筛选会编译为ChromaDB的where条件，只在匹配的条目中检索，
+        因此只要匹配条目足够，总能返回limit条结果。
+        
         Args:
             query (str): 查询文本
             course_id (int, optional): 课程ID，用于筛选指定课程的知识
             limit (int): 返回结果数量限制
+            category (str, optional): 分类，用于筛选指定分类的知识
+            tags (list, optional): 标签列表，只返回包含全部标签的知识
+            backfill (bool): 回填模式。标签条件不下推，而是逐步扩大检索数量后在本地筛选，
+                直到凑满limit条或没有更多结果。用于尚未写入标签元数据的旧条目。
+            include_record (bool): 是否查询数据库获取完整记录(full_record)。
+                为False时只返回ChromaDB中的元数据，不访问数据库。
+            hybrid (bool): 混合检索模式。并发执行向量检索和词法检索(标题、内容、标签)，
+                用倒数排名融合(RRF)合并结果，适合公式名、课程代码等精确术语。
             
         Returns:
             list: 匹配结果列表
         """
-        # 使用ChromaDB搜索
-        search_results = knowledge_base_collection.query(
-            query_texts=[query],
-            n_results=limit
+        results, _ = KnowledgeBaseService._search(query, course_id, limit, category, tags, backfill, hybrid)
+        if include_record:
+            KnowledgeBaseService._attach_records(results)
+        return results
+    
+    @staticmethod
+    def _search(query, course_id, limit, category, tags, backfill, hybrid):
+        """检索并返回(结果列表, 是否完整)。混合检索中有一路超时、失败或被跳过时结果不完整。"""
+        if hybrid:
+            return KnowledgeBaseService._hybrid_search(query, course_id, limit, category, tags, backfill)
+        return KnowledgeBaseService._vector_search(query, course_id, limit, category, tags, backfill), True
+    
+    @staticmethod
+    def search_knowledge_many(queries, course_id=None, limit=5, category=None, tags=None,
+                              include_record=True, deduplicate=True):
+        """一次搜索多个相关查询。
+        
+        所有查询在一次ChromaDB调用中批量嵌入和检索，完整记录也只用一次IN查询获取。
+        规范化后相同的查询只检索一次，并得到相同的结果。
+        
+        Args:
+            queries (list): 查询文本列表
+            course_id (int, optional): 课程ID，用于筛选指定课程的知识
+            limit (int): 每个查询返回结果数量限制
+            category (str, optional): 分类，用于筛选指定分类的知识
+            tags (list, optional): 标签列表，只返回包含全部标签的知识
+            include_record (bool): 是否查询数据库获取完整记录(full_record)
+            deduplicate (bool): 是否跨查询去重。为True时每个条目只出现在距离最近的那个查询的结果中。
+            
+        Returns:
+            list: 与queries一一对应的结果列表
+        """
+        if not queries:
+            return []
+        
+        # 合并规范化后相同的查询，否则去重时重复的查询会被前一个抢走全部结果
+        keys = [normalize_content(query).lower() for query in queries]
+        positions = {}
+        unique_queries = []
+        for key, query in zip(keys, queries):
+            if key not in positions:
+                positions[key] = len(unique_queries)
+                unique_queries.append(query)
+        
+        def select(search_results):
+            results_per_query = [
+                KnowledgeBaseService._format_results(search_results, i)
+                for i in range(len(unique_queries))
+            ]
+            if not deduplicate:
+                return results_per_query
+            # 每个条目归属于距离最近的查询
+            best = {}
+            for i, results in enumerate(results_per_query):
+                for result in results:
+                    current = best.get(result["id"])
+                    if current is None or (result["distance"] or 0) < (current[1] or 0):
+                        best[result["id"]] = (i, result["distance"])
+            return [
+                [result for result in results if best[result["id"]][0] == i]
+                for i, results in enumerate(results_per_query)
+            ]
+        
+        # 去重会移除部分结果，多取一些候选
+        n_results = limit * BACKFILL_FACTOR if deduplicate else limit
+        unique_results = KnowledgeBaseService._widening_query(
+            unique_queries, limit, n_results, _build_where(course_id, category, tags), select)
+        # 展开回原来的查询顺序，重复的查询得到结果的副本
+        results_per_query = [
+            [dict(result) for result in unique_results[positions[key]]]
+            for key in keys
+        ]
+        
+        if include_record:
+            KnowledgeBaseService._attach_records(
+                [result for results in results_per_query for result in results])
+        return results_per_query
+    
+    @register_as_tool(roles=["student", "teacher"])
+    @staticmethod
+    def search_knowledge_base(queries: list, course_id: int = None, limit: int = 5):
+        """在知识库中语义搜索课程知识条目，可以一次传入同一问题的多种说法。
+        
+        Args:
+            queries (list): 查询文本列表，如["快速排序的时间复杂度", "quicksort complexity"]
+            course_id (int, optional): 课程ID，只搜索该课程的知识
+            limit (int): 每个查询返回的结果数量
+            
+        Returns:
+            list: 与queries一一对应的结果列表，每条结果包含id、title、content、category、tags，
+                同一条目只会出现一次
+        """
+        return KnowledgeBaseService.search_knowledge_many(
+            queries, course_id=course_id, limit=limit, include_record=False)
+    
+    @staticmethod
+    def cached_search(query, course_id=None, limit=5, category=None, tags=None, hybrid=False):
+        """带缓存的知识库搜索，用于高频的AJAX搜索请求。
+        
+        参数含义同search_knowledge，结果不包含完整记录。查询文本经过规范化
+        (全角半角、空白、大小写)后与其他参数一起作为缓存键。
+        
+        Returns:
+            list: 匹配结果列表
+        """
+        key = (
+            _knowledge_version,
+            normalize_content(query).lower(),
+            int(course_id) if course_id is not None else None,
+            limit,
+            category or None,
+            tuple(sorted(tags or [])),
+            hybrid
         )
+        results = search_cache.get(key)
+        if results is None:
+            results, complete = KnowledgeBaseService._search(
+                query, course_id, limit, category, tags, False, hybrid)
+            # 不完整的结果不缓存，否则在TTL内一直返回降级的结果
+            if complete:
+                search_cache.put(key, results)
+        # 返回副本，调用方修改结果不会影响缓存
+        return [dict(result) for result in results]
+    
+    @staticmethod
+    def search_cache_stats():
+        """获取搜索结果缓存的命中率等统计信息。
+        
+        Returns:
+            dict: 缓存统计信息
+        """
+        stats = search_cache.stats()
+        stats["version"] = _knowledge_version
+        return stats
+    
+    @staticmethod
+    def _vector_search(query, course_id, limit, category, tags, backfill):
+        """在ChromaDB中检索，返回不含完整记录的结果列表。
+        
+        命中的块按所属条目合并，每个条目只保留距离最近的一块作为内容。
+        """
+        if backfill:
+            # 回填模式：课程和分类仍然下推，标签在本地筛选
+            where = _build_where(course_id, category)
+            n_results = limit * BACKFILL_FACTOR
+        else:
+            where = _build_where(course_id, category, tags)
+            n_results = limit
+        
+        def select(search_results):
+            results = KnowledgeBaseService._format_results(search_results)
+            if backfill and tags:
+                results = [result for result in results if set(tags).issubset(result["tags"])]
+            return [results]
+        
+        return KnowledgeBaseService._widening_query([query], limit, n_results, where, select)[0]
+    
+    @staticmethod
+    def _widening_query(queries, limit, n_results, where, select):
+        """在ChromaDB中检索，结果不足时逐步扩大检索数量重试。
         
+        同一条目的多个块、本地筛选和跨查询去重都会占用检索名额，因此每个查询都凑满limit条结果
+        或已没有更多条目之前，检索数量每轮乘以BACKFILL_FACTOR。一轮扩大没有带来新的条目，
+        或检索数量达到MAX_SEARCH_RESULTS时停止，返回已有的结果。
+        
+        Args:
+            queries (list): 查询文本列表
+            limit (int): 每个查询需要的结果数量
+            n_results (int): 第一轮的检索数量
+            where (dict): ChromaDB的where条件
+            select (callable): 将检索结果转换为与queries一一对应的结果列表
+            
+        Returns:
+            list: 与queries一一对应的结果列表，每个最多limit条
+        """
+        # 第一轮的检索数量本身超过上限时不再扩大
+        max_results = max(n_results, MAX_SEARCH_RESULTS)
+        seen = None
+        while True:
+            search_results = knowledge_base_collection.query(
+                query_texts=queries,
+                n_results=n_results,
+                where=where
+            )
+            results_per_query = select(search_results)
+            # 结果已凑满，或检索结果少于请求数量说明已没有更多条目
+            complete = all(len(results) >= limit or len(search_results["ids"][i]) < n_results
+                           for i, results in enumerate(results_per_query))
+            found = len({result["id"] for results in results_per_query for result in results})
+            if complete or found == seen or n_results >= max_results:
+                return [results[:limit] for results in results_per_query]
+            seen = found
+            n_results = min(n_results * BACKFILL_FACTOR, max_results)
+    
+    @staticmethod
+    def _lexical_search(index, query, course_id, limit, category, tags):
+        """在词法索引中检索，返回不含完整记录的结果列表。"""
+        def where(fields):
+            return ((course_id is None or fields["course_id"] == int(course_id))
+                    and (not category or fields["category"] == category)
+                    and (not tags or set(tags).issubset(fields["tags"])))
+        
+        hits = index.search(query, limit, where)
+        return [dict(fields) for _, _, fields in hits]
+    
+    @staticmethod
+    def _hybrid_search(query, course_id, limit, category, tags, backfill):
+        """并发执行向量检索和词法检索，用倒数排名融合合并结果。
+        
+        整个调用共用HYBRID_TIMEOUT的时间预算，超时或失败的一路不参与融合；词法索引尚未构建完成时
+        只使用向量检索。
+        
+        Returns:
+            tuple: (结果列表, 是否完整)，有一路没有参与融合时不完整
+        """
+        # 每路多取一些候选，融合后再截断
+        candidates = limit * BACKFILL_FACTOR
+        futures = {"vector": _search_executor.submit(
+            KnowledgeBaseService._vector_search, query, course_id, candidates, category, tags, backfill)}
+        index = _get_lexical_index()
+        if index is None:
+            logger.info("Hybrid search: lexical index is still building, skipped")
+        else:
+            futures["lexical"] = _lexical_executor.submit(
+                KnowledgeBaseService._lexical_search, index, query, course_id, candidates, category, tags)
+        wait(futures.values(), timeout=HYBRID_TIMEOUT)
+        
+        ranked_lists = []
+        for name, future in futures.items():
+            if not future.done():
+                logger.warning(f"Hybrid search: {name} retriever exceeded {HYBRID_TIMEOUT}s, skipped")
+            elif future.exception() is not None:
+                logger.error(f"Hybrid search: {name} retriever failed: {future.exception()}")
+            else:
+                ranked_lists.append(future.result())
+        complete = index is not None and len(ranked_lists) == len(futures)
+        if not ranked_lists:
+            logger.error("Hybrid search: no retriever returned results")
+            return [], False
+        
+        scores = {}
+        fused = {}
+        for ranked in ranked_lists:
+            for rank, result in enumerate(ranked):
+                scores[result["id"]] = scores.get(result["id"], 0) + 1 / (RRF_K + rank + 1)
+                # 优先保留向量检索的结果，它带有距离
+                fused.setdefault(result["id"], result)
+        
+        results = sorted(fused.values(), key=lambda result: scores[result["id"]], reverse=True)[:limit]
+        for result in results:
+            result["score"] = scores[result["id"]]
+        return results, complete
+    
+    @staticmethod
+    def _format_results(search_results, query_index=0):
+        """将ChromaDB的检索结果转换为结果字典列表，多个块命中同一条目时合并为一条。
+        
+        Args:
+            search_results (dict): collection.query的返回值
+            query_index (int): 多个查询时，要转换的查询序号
+        """
         results = []
-        if len(search_results["ids"]) > 0:
-            for i, vector_id in enumerate(search_results["ids"][0]):
-                metadata = search_results["metadatas"][0][i]
-                document = search_results["documents"][0][i]
+        seen = set()
+        if len(search_results["ids"]) > query_index:
+            for i, vector_id in enumerate(search_results["ids"][query_index]):
+                metadata = search_results["metadatas"][query_index][i]
+                document = search_results["documents"][query_index][i]
                 distance = None
                 if "distances" in search_results:
-                    distance = search_results["distances"][0][i]
+                    distance = search_results["distances"][query_index][i]
                 
-                # 如果指定了课程筛选，检查是否匹配
-                if course_id is not None and metadata["course_id"] != course_id:
+                # 结果按距离排序，同一条目只保留最先出现(最相关)的块
+                if metadata["id"] in seen:
                     continue
-                
-                # 获取完整记录
-                db_record = KnowledgeBase.get_or_none(KnowledgeBase.vector_id == vector_id)
+                seen.add(metadata["id"])
                 
                 results.append({
                     "id": metadata["id"],
@@ -94,11 +706,29 @@ class KnowledgeBaseService:
                     "category": metadata["category"],
                     "course_id": metadata["course_id"],
                     "tags": metadata["tags"].split(",") if metadata["tags"] else [],
-                    "full_record": db_record
+                    "chunk": metadata.get("chunk", 0)
                 })
                 
         return results
     
+    @staticmethod
+    def _attach_records(results):
+        """用一次IN查询获取所有结果的完整记录，写入full_record字段。
+        
+        同时关联查询课程，避免页面访问full_record.course时逐条查询。
+        """
+        ids = [result["id"] for result in results]
+        records = {}
+        if ids:
+            query = (KnowledgeBase
+                     .select(KnowledgeBase, Course)
+                     .join(Course, JOIN.LEFT_OUTER)
+                     .where(KnowledgeBase.id.in_(ids)))
+            records = {record.id: record for record in query}
+        for result in results:
+            result["full_record"] = records.get(result["id"])
+        return results
+    
     @staticmethod
     def delete_knowledge(knowledge_id):
         """删除知识条目。
@@ -113,27 +743,33 @@ class KnowledgeBaseService:
         if not knowledge or not knowledge.vector_id:
             return False
             
-        # 从向量数据库中删除
+        # 从向量数据库中删除条目的全部块
         try:
             knowledge_base_collection.delete(ids=[knowledge.vector_id])
+            knowledge_base_collection.delete(where={"vector_id": knowledge.vector_id})
         except:
             pass  # 即使向量删除失败也继续删除数据库记录
             
         # 删除数据库记录
         knowledge.delete_instance()
+        _update_lexical(knowledge_id)
+        _bump_version()
         return True
     
     @staticmethod
     def update_knowledge(knowledge_id, title=None, content=None, 
-                        category=None, tags=None):
+                        category=None, tags=None, course_id=_UNSET):
         """更新知识条目。
         
+        向量数据库中的条目原地更新。只修改标题、分类、标签或课程时，仅更新元数据，不重新计算嵌入向量。
+        
         Args:
             knowledge_id (int): 知识条目ID
             title (str, optional): 新标题
             content (str, optional): 新内容
             category (str, optional): 新分类
             tags (list, optional): 新标签列表
+            course_id (int, optional): 新关联课程ID，传入None表示取消关联，不传则不修改
             
         Returns:
             KnowledgeBase: 更新后的知识条目对象
@@ -145,6 +781,9 @@ class KnowledgeBaseService:
         if not knowledge:
             raise ValueError(f"知识条目ID {knowledge_id} 不存在")
             
+        old_content = knowledge.content
+        old_tags = knowledge.tags or []
+        
         # 更新数据库记录
         if title is not None:
             knowledge.title = title
@@ -154,29 +793,73 @@ class KnowledgeBaseService:
             knowledge.category = category
         if tags is not None:
             knowledge.tags = tags
+        if course_id is not _UNSET:
+            knowledge.course_id = course_id
             
         knowledge.save()
+        _index_lexical(knowledge.id, knowledge.title, knowledge.content,
+                       knowledge.course_id, knowledge.category, knowledge.tags)
+        try:
+            changed = (content is not None or title is not None or category is not None
+                       or tags is not None or course_id is not _UNSET)
+            if not changed or not knowledge.vector_id:
+                return knowledge
+        
+            # 原地更新向量数据库，不先删除再添加，避免索引碎片和条目短暂不可检索
+            existing_ids = _get_chunk_ids(knowledge.vector_id)
+            removed_tags = set(old_tags) - set(knowledge.tags or [])
         
-        # 如果内容或元数据变化，更新向量数据库
-        if content is not None or title is not None or category is not None or tags is not None:
-            if knowledge.vector_id:
-                try:
-                    # 删除旧向量
-                    knowledge_base_collection.delete(ids=[knowledge.vector_id])
-                except:
-                    pass
-                    
-                # 添加新向量
+            if knowledge.content == old_content and existing_ids:
+                # 只有元数据变化：更新所有块的元数据，并删除已移除标签的键
+                metadata = _build_metadata(
+                    knowledge.id,
+                    knowledge.title,
+                    knowledge.course_id,
+                    knowledge.category,
+                    knowledge.tags
+                )
+                for tag in removed_tags:
+                    metadata[TAG_KEY_PREFIX + tag] = None
+                ids = sorted(existing_ids)
+                knowledge_base_collection.update(ids=ids, metadatas=[dict(metadata) for _ in ids])
+                return knowledge
+        
+            # 内容变化：重新分块，已存在的块原地更新，新增的块添加，多余的块删除
+            ids, documents, metadatas = _build_chunks(
+                knowledge.vector_id,
+                knowledge.id,
+                knowledge.title,
+                knowledge.content,
+                knowledge.course_id,
+                knowledge.category,
+                knowledge.tags
+            )
+            embeddings = _embed(documents)
+            updated = [i for i, chunk_id in enumerate(ids) if chunk_id in existing_ids]
+            added = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing_ids]
+        
+            if updated:
+                for i in updated:
+                    for tag in removed_tags:
+                        metadatas[i][TAG_KEY_PREFIX + tag] = None
+                knowledge_base_collection.update(
+                    ids=[ids[i] for i in updated],
+                    embeddings=[embeddings[i] for i in updated],
+                    documents=[documents[i] for i in updated],
+                    metadatas=[metadatas[i] for i in updated]
+                )
+            if added:
                 knowledge_base_collection.add(
-                    ids=[knowledge.vector_id],
-                    documents=[knowledge.content],
-                    metadatas=[{
-                        "id": knowledge.id,
-                        "title": knowledge.title,
-                        "category": knowledge.category or "",
-                        "course_id": knowledge.course_id or 0,
-                        "tags": ",".join(knowledge.tags) if knowledge.tags else ""
-                    }]
+                    ids=[ids[i] for i in added],
+                    embeddings=[embeddings[i] for i in added],
+                    documents=[documents[i] for i in added],
+                    metadatas=[metadatas[i] for i in added]
                 )
+            stale_ids = existing_ids - set(ids)
+            if stale_ids:
+                knowledge_base_collection.delete(ids=sorted(stale_ids))
+        finally:
+            # 向量写入完成后再使缓存失效，否则写入期间的搜索会把旧结果缓存到新版本下
+            _bump_version()
                 
         return knowledge
@@ -45,7 +45,8 @@ class RecommendService:
             answer: list of recommendations
         """
         prompt = "根据我的历史学习情况，给出学习资源推荐。你可以推荐一个或多个学科。"
-        answer = run(basic_prompt+prompt, 'student')
+        # 基于个人学习数据的推荐不使用LLM响应缓存
+        answer = run(basic_prompt+prompt, 'student').answer
         return answer
 
     @staticmethod
@@ -56,7 +57,8 @@ class RecommendService:
             answer: list of recommendations
         """
         prompt = f"请给出{subject}学科，{chapter}章节的知识推荐"
-        answer = run(basic_prompt + prompt, 'student')
+        # 相同的学科和章节会产生相同的请求，可以使用LLM响应缓存
+        answer = run(basic_prompt + prompt, 'student', cache='recommend_requirement').answer
         return answer
 
     @register_as_tool(roles=['student', 'teacher'])
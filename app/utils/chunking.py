@@ -0,0 +1,48 @@
+from typing import List
+import re
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n|\n")
+
+
+def split_into_chunks(text: str, max_chars: int = 250, overlap: int = 50) -> List[str]:
+    """
+    Splits text into chunks for embedding.
+
+    Consecutive paragraphs are packed into one chunk while it stays within max_chars, and each chunk
+    repeats the last overlap characters of the previous one so that sentences crossing a boundary
+    can still be matched. Paragraphs longer than max_chars are cut into sliding windows.
+
+    Args:
+        text (str): The text to split.
+        max_chars (int): The maximum length of a chunk in characters.
+        overlap (int): The number of characters shared by adjacent chunks.
+
+    Returns:
+        List[str]: The chunks, in document order. Always contains at least one chunk.
+    """
+    paragraphs = [paragraph.strip() for paragraph in _PARAGRAPH_BREAK.split(text or "") if paragraph.strip()]
+    chunks: List[str] = []
+    current = ""
+    step = max(max_chars - overlap, 1)
+
+    for paragraph in paragraphs:
+        if len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            for start in range(0, len(paragraph), step):
+                chunks.append(paragraph[start:start + max_chars])
+                if start + max_chars >= len(paragraph):
+                    break
+        elif not current:
+            current = paragraph
+        elif len(current) + 1 + len(paragraph) <= max_chars:
+            current = current + "\n" + paragraph
+        else:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ""
+            current = tail + "\n" + paragraph if tail and len(tail) + 1 + len(paragraph) <= max_chars else paragraph
+
+    if current:
+        chunks.append(current)
+    return chunks or [text or ""]
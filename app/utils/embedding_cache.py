@@ -0,0 +1,124 @@
+from app.utils.logging import logger
+from array import array
+from typing import Callable
+from typing import List
+from typing import Optional
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+
+
+def normalize_content(text: str) -> str:
+    """
+    Normalizes text before hashing so that formatting-only differences share a cache entry.
+
+    Args:
+        text (str): The raw text.
+
+    Returns:
+        str: The NFKC-normalized text with whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """
+    A persistent embedding cache keyed by the hash of the model name and the normalized content.
+    """
+
+    def __init__(self, path: str, model_name: str) -> None:
+        """
+        Opens (or creates) the SQLite file backing the cache.
+
+        Args:
+            path (str): The path to the SQLite file.
+            model_name (str): The name of the embedding model. Part of every key, so switching
+                models never returns stale vectors.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        """
+        Computes the cache key of a text.
+
+        Args:
+            text (str): The raw text.
+
+        Returns:
+            str: The SHA-256 hex digest of the model name and the normalized text.
+        """
+        payload = f"{self.model_name}\n{normalize_content(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Looks up cached embeddings.
+
+        Args:
+            texts (List[str]): The texts to look up.
+
+        Returns:
+            List[Optional[List[float]]]: The cached embedding of each text, or None on a miss.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]) -> None:
+        """
+        Stores embeddings in the cache.
+
+        Args:
+            texts (List[str]): The embedded texts.
+            embeddings (List[List[float]]): The embedding of each text.
+        """
+        rows = [
+            (self.key(text), array("f", embedding).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def embed(self, texts: List[str], embedding_function: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Returns the embeddings of the texts, computing only the cache misses in one batch.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            embedding_function (Callable): Embeds a list of texts, e.g. the Chroma collection's embedding function.
+
+        Returns:
+            List[List[float]]: The embedding of each text, in input order.
+        """
+        embeddings = self.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = embedding_function([texts[i] for i in missing])
+            computed = [list(map(float, embedding)) for embedding in computed]
+            self.put_many([texts[i] for i in missing], computed)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        return embeddings
@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import threading
+import time
+import uuid
+
+from app.utils.logging import logger
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class JobRejected(Exception):
+    """Raised when admission control refuses a job."""
+
+    def __init__(self, message: str, reason: str) -> None:
+        """
+        Args:
+            message (str): A human-readable message.
+            reason (str): "queue_full" or "user_limit".
+        """
+        self.reason = reason
+        super().__init__(message)
+
+
+class Job:
+    """
+    A unit of work in a JobQueue, with its status, result and a log of progress events.
+    """
+
+    def __init__(self, kind: str, owner: Any) -> None:
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = JobStatus.QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events: List[Tuple[str, Any]] = []
+        self._changed = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    def publish(self, event: str, data: Any) -> None:
+        """
+        Appends a progress event and wakes up subscribers.
+
+        Args:
+            event (str): The event type.
+            data (Any): The JSON-serializable payload.
+        """
+        with self._changed:
+            self.events.append((event, data))
+            self._changed.notify_all()
+
+    def subscribe(self, after: int = 0, timeout: float = 15.0) -> Iterator[Tuple[int, str, Any]]:
+        """
+        Yields the job's events from index `after` on, until the job is done.
+
+        Yields ("ping", None) after `timeout` seconds without events so that callers can send keep-alives.
+
+        Args:
+            after (int): The index of the first event to yield; lets reconnecting clients resume.
+            timeout (float): Seconds to wait for a new event before yielding a ping.
+
+        Yields:
+            Tuple[int, str, Any]: (index, event, data) tuples.
+        """
+        index = after
+        while True:
+            with self._changed:
+                if index >= len(self.events) and not self.done:
+                    self._changed.wait(timeout)
+                pending = self.events[index:]
+                done = self.done
+            if not pending and not done:
+                yield index, "ping", None
+            for event, data in pending:
+                yield index, event, data
+                index += 1
+            if done and index >= len(self.events):
+                return
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the job is done.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait.
+
+        Returns:
+            bool: Whether the job is done.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.done, timeout)
+
+    def _finish(self, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the job's state, without the event log.
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": len(self.events),
+        }
+
+
+class JobQueue:
+    """
+    An in-process job queue served by a bounded pool of worker threads.
+
+    Admission control rejects jobs once max_workers + max_queued jobs are in flight, and once an owner
+    already has per_owner_limit jobs queued or running. Finished jobs are kept for `retention` seconds
+    so that clients can collect their results.
+
+    Jobs, their events and the admission counters live in the memory of one process. With several server
+    processes (e.g. gunicorn -w N) a job can only be read from the process that accepted it, and every limit
+    applies per process, so the effective limits are N times larger. Run a single worker process (scale with
+    threads), or route each user to the same process (sticky sessions).
+    """
+
+    def __init__(self, max_workers: int = 4, max_queued: int = 32, per_owner_limit: int = 2,
+                 retention: float = 600) -> None:
+        """
+        Args:
+            max_workers (int): The number of worker threads.
+            max_queued (int): The number of jobs allowed to wait for a worker.
+            per_owner_limit (int): The number of unfinished jobs allowed per owner.
+            retention (float): Seconds to keep finished jobs.
+        """
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.per_owner_limit = per_owner_limit
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._active: Dict[Any, int] = {}
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, owner: Any, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Job:
+        """
+        Enqueues func(job, *args, **kwargs); its return value becomes the job result.
+
+        Args:
+            kind (str): The job type, e.g. "chat".
+            owner (Any): The owner the per-owner limit applies to, usually a user ID.
+            func (Callable): The work; receives the Job first so it can publish progress events.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            JobRejected: If the queue is full or the owner has too many unfinished jobs.
+        """
+        job = Job(kind, owner)
+        with self._lock:
+            self._prune()
+            if self._in_flight >= self.max_workers + self.max_queued:
+                self._rejected += 1
+                raise JobRejected("Too many jobs in progress, please try again later", "queue_full")
+            if self._active.get(owner, 0) >= self.per_owner_limit:
+                self._rejected += 1
+                raise JobRejected("Too many of your jobs are in progress, please wait for them to finish", "user_limit")
+            self._in_flight += 1
+            self._active[owner] = self._active.get(owner, 0) + 1
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job: Job, func: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            job._finish(JobStatus.SUCCEEDED, result=func(job, *args, **kwargs))
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            job._finish(JobStatus.FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._active[job.owner] -= 1
+                if not self._active[job.owner]:
+                    del self._active[job.owner]
+
+    def _prune(self) -> None:
+        """Drops finished jobs older than the retention period. The caller must hold the lock."""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Looks up a job.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            Optional[Job]: The job, or None if it does not exist or has been pruned.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Reports queue usage.
+
+        Returns:
+            Dict[str, Any]: Worker and queue capacity, in-flight and running counts, and rejections.
+        """
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == JobStatus.RUNNING)
+            return {
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "per_owner_limit": self.per_owner_limit,
+                "in_flight": self._in_flight,
+                "running": running,
+                "queued": self._in_flight - running,
+                "rejected": self._rejected,
+                "retained": len(self._jobs),
+            }
@@ -0,0 +1,173 @@
+from typing import Any, List, Tuple
+import ast
+import json
+import re
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class JSONRepairError(ValueError):
+    """Raised when a text cannot be turned into JSON even after repair."""
+
+
+class JSONTruncatedError(JSONRepairError):
+    """Raised when a text only parses after closing strings or brackets that were cut off."""
+
+
+def _extract(text: str) -> str:
+    """Returns the part of an LLM response most likely to hold the JSON value."""
+    match = _FENCE.search(text)
+    if match and match.group(1).strip():
+        text = match.group(1)
+    starts = [index for index in (text.find("{"), text.find("[")) if index != -1]
+    return text[min(starts):].strip() if starts else text.strip()
+
+
+def repair_json(text: str) -> str:
+    """
+    Rewrites almost-JSON into JSON in a single pass over the text. See _repair.
+
+    Args:
+        text (str): The almost-JSON text, starting at the opening bracket.
+
+    Returns:
+        str: The repaired text; valid JSON unless the input is damaged beyond these fixes.
+    """
+    return _repair(text)[0]
+
+
+def _repair(text: str) -> Tuple[str, bool]:
+    """
+    Rewrites almost-JSON into JSON in a single pass over the text.
+
+    The scanner tracks string and bracket state as it goes, which lets it fix the slips LLMs commonly make:
+    single-quoted strings, unquoted keys, raw newlines and tabs inside strings, Python literals (True/False/None),
+    // and /* */ comments, trailing commas, text after the top-level value, and output truncated
+    in the middle of a string or object (open strings and brackets are closed at the end).
+
+    Args:
+        text (str): The almost-JSON text, starting at the opening bracket.
+
+    Returns:
+        Tuple[str, bool]: The repaired text, and whether the input was cut off, i.e. open strings or
+            brackets had to be closed. Content after a cut-off is lost, so such a value may be incomplete.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    quote = None
+    i = 0
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if quote:
+            if char == "\\" and i + 1 < n:
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if char == quote:
+                out.append('"')
+                quote = None
+            elif char == '"':
+                out.append('\\"')  # a double quote inside a single-quoted string
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\r":
+                out.append("\\r")
+            elif char == "\t":
+                out.append("\\t")
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char in "\"'":
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            # Drop a trailing comma before the closing bracket
+            while out and out[-1].strip() in ("", ","):
+                if out[-1].strip() == ",":
+                    out.pop()
+                    break
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break  # ignore anything after the top-level value
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        elif char.isalpha() or char == "_":
+            match = re.match(r"[A-Za-z_][A-Za-z0-9_]*", text[i:])
+            word = match.group()
+            i += len(word)
+            if re.match(r"\s*:", text[i:]):
+                out.append(f'"{word}"')  # an unquoted key
+            else:
+                out.append(_LITERALS.get(word, word))
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    truncated = bool(quote or stack)
+    if quote:
+        out.append('"')
+    while out and out[-1].strip() in ("", ",", ":"):
+        if out[-1].strip() == ":":
+            out.append("null")
+            break
+        out.pop()
+    out.extend(reversed(stack))
+    return "".join(out), truncated
+
+
+def parse_json_object(text: str, allow_truncated: bool = False) -> Tuple[Any, bool]:
+    """
+    Parses the JSON value in an LLM response, repairing it locally if needed.
+
+    Markdown code fences and prose around the value are ignored. Strict parsing is tried first,
+    then repair_json, then Python literal syntax.
+
+    Args:
+        text (str): The LLM response.
+        allow_truncated (bool): Whether to accept a response that was cut off, once its open strings and
+            brackets are closed. Off by default, since the value would silently miss its end.
+
+    Returns:
+        Tuple[Any, bool]: The parsed value, and whether it needed repair.
+
+    Raises:
+        JSONTruncatedError: If the response was cut off and allow_truncated is False.
+        JSONRepairError: If no JSON value can be recovered.
+    """
+    candidate = _extract(text)
+    try:
+        return json.loads(candidate), False
+    except json.JSONDecodeError:
+        pass
+    repaired, truncated = _repair(candidate)
+    try:
+        value = json.loads(repaired)
+    except json.JSONDecodeError:
+        pass
+    else:
+        if truncated and not allow_truncated:
+            raise JSONTruncatedError(f"Response was cut off: {text[-200:]}")
+        return value, True
+    try:
+        value = ast.literal_eval(candidate)
+        if isinstance(value, (dict, list)):
+            return value, True
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    raise JSONRepairError(f"Could not parse JSON from response: {text[:200]}")
@@ -0,0 +1,156 @@
+from collections import defaultdict
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import math
+import re
+import threading
+
+try:
+    import jieba
+except ImportError:  # jieba is optional, fall back to character bigrams
+    jieba = None
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_WORD = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[A-Za-z0-9_]+(?:[.\-+#][A-Za-z0-9_]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lexical tokens.
+
+    ASCII words (course codes, formula names such as "CS101" or "O(n)") are kept whole and lowercased.
+    Chinese runs are segmented with jieba when it is installed; otherwise they are split into
+    single characters plus overlapping bigrams, which matches exact terms without a dictionary.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The tokens.
+    """
+    tokens = []
+    for match in _WORD.finditer(text or ""):
+        word = match.group()
+        if not _CJK.fullmatch(word):
+            tokens.append(word.lower())
+        elif jieba is not None:
+            tokens.extend(token for token in jieba.cut_for_search(word) if token.strip())
+        else:
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """
+    A thread-safe in-memory inverted index ranked with BM25.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, tokenizer: Callable[[str], List[str]] = tokenize) -> None:
+        """
+        Initializes an empty index.
+
+        Args:
+            k1 (float): BM25 term-frequency saturation.
+            b (float): BM25 length normalization.
+            tokenizer (Callable[[str], List[str]]): The tokenizer used for documents and queries.
+        """
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self.postings: Dict[str, Dict[Any, int]] = defaultdict(dict)
+        self.doc_lengths: Dict[Any, int] = {}
+        self.doc_terms: Dict[Any, List[str]] = {}
+        self.documents: Dict[Any, Dict[str, Any]] = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, doc_id: Any, text: str, fields: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Adds or replaces a document.
+
+        Args:
+            doc_id (Any): The document ID.
+            text (str): The text to index.
+            fields (Dict[str, Any], optional): Stored fields returned with hits and used for filtering.
+        """
+        tokens = self.tokenizer(text)
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        with self._lock:
+            self._remove(doc_id)
+            for token, count in counts.items():
+                self.postings[token][doc_id] = count
+            self.doc_lengths[doc_id] = len(tokens)
+            self.doc_terms[doc_id] = list(counts)
+            self.documents[doc_id] = fields or {}
+            self.total_length += len(tokens)
+
+    def remove(self, doc_id: Any) -> None:
+        """
+        Removes a document if it is indexed.
+
+        Args:
+            doc_id (Any): The document ID.
+        """
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: Any) -> None:
+        if doc_id not in self.documents:
+            return
+        for token in self.doc_terms.pop(doc_id):
+            docs = self.postings[token]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[token]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        del self.documents[doc_id]
+
+    def search(self, query: str, limit: int = 10,
+               where: Optional[Callable[[Dict[str, Any]], bool]] = None) -> List[Tuple[Any, float, Dict[str, Any]]]:
+        """
+        Ranks documents against the query with BM25.
+
+        Args:
+            query (str): The query text.
+            limit (int): The maximum number of hits.
+            where (Callable, optional): A predicate on the stored fields; documents failing it are skipped.
+
+        Returns:
+            List[Tuple[Any, float, Dict[str, Any]]]: (doc_id, score, fields) tuples, best first.
+        """
+        terms = set(self.tokenizer(query))
+        scores: Dict[Any, float] = defaultdict(float)
+        with self._lock:
+            n_docs = len(self.documents)
+            if not n_docs or not terms:
+                return []
+            avg_length = self.total_length / n_docs
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            hits = []
+            for doc_id, score in ranked:
+                fields = self.documents[doc_id]
+                if where is not None and not where(fields):
+                    continue
+                hits.append((doc_id, score, fields))
+                if len(hits) >= limit:
+                    break
+            return hits
+
@@ -0,0 +1,481 @@
+from openai import OpenAI, AsyncOpenAI
+from openai import APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Iterator, List, Optional
+import asyncio
+import httpx
+import os
+import random
+import threading
+import time
+
+from app.utils.llm.response_cache import ResponseCache
+from app.utils.logging import logger
+
+# Errors worth retrying: network failures, timeouts, rate limiting and 5xx responses
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+# The same conditions at the HTTP level, for the async transport
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# How often a waiting async request polls the semaphore it shares with the sync client
+SEMAPHORE_POLL_INTERVAL = 0.05
+
+
+class LLMStreamError(RuntimeError):
+    """Raised when a streamed response fails, so callers never mistake a partial response for a complete one."""
+
+
+class ProviderConfig(BaseModel):
+    """
+    Connection settings of an OpenAI-compatible LLM provider.
+    """
+    name: str = Field(..., description="The provider name used in the registry.")
+    base_url: str = Field(..., description="The OpenAI-compatible API base URL.")
+    api_key_env: Optional[str] = Field(None, description="The environment variable holding the API key.")
+    api_key: Optional[str] = Field(None, description="A fixed API key, used when api_key_env is not set.")
+    default_model: str = Field(..., description="The model used when the caller does not pass one.")
+    default_params: Dict[str, Any] = Field(default_factory=dict, description="Sampling parameters sent with every request.")
+    timeout: float = Field(60.0, description="Per-request timeout in seconds.")
+    max_concurrency: int = Field(8, description="Maximum in-flight requests; also the keep-alive pool size.")
+    max_retries: int = Field(3, description="Retries of transient errors.")
+    backoff_base: float = Field(0.5, description="Base of the exponential backoff in seconds.")
+    backoff_max: float = Field(8.0, description="Upper bound of a single backoff in seconds.")
+    json_mode: bool = Field(False, description="Whether the provider supports response_format json_object.")
+
+
+class Completion(BaseModel):
+    """
+    The result of a chat completion.
+    """
+    content: Optional[str] = Field(None, description="The generated text, or None on failure.")
+    model: str = Field(..., description="The model that produced the completion.")
+    prompt_tokens: Optional[int] = Field(None, description="Prompt tokens reported by the provider.")
+    completion_tokens: Optional[int] = Field(None, description="Completion tokens reported by the provider.")
+    latency: float = Field(0.0, description="Wall-clock latency in seconds, including retries.")
+    attempts: int = Field(1, description="Number of attempts made.")
+    cached: bool = Field(False, description="Whether the content came from the response cache.")
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name) or default)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name) or default)
+
+
+PROVIDERS: Dict[str, ProviderConfig] = {
+    "deepseek": ProviderConfig(
+        name="deepseek",
+        base_url="https://api.deepseek.com",
+        api_key_env="DEEPSEEK_API_KEY",
+        default_model="deepseek-chat",
+        json_mode=True,
+        timeout=_env_float("LLM_DEEPSEEK_TIMEOUT", 120.0),
+        max_concurrency=_env_int("LLM_DEEPSEEK_MAX_CONCURRENCY", 16),
+    ),
+    "lm_studio": ProviderConfig(
+        name="lm_studio",
+        base_url=os.getenv("LM_STUDIO_BASE_URL") or "http://127.0.0.1:1234/v1",
+        api_key="lm-studio",
+        default_model="meta-llama-3.1-8b-instruct",
+        timeout=_env_float("LLM_LM_STUDIO_TIMEOUT", 300.0),
+        max_concurrency=_env_int("LLM_LM_STUDIO_MAX_CONCURRENCY", 2),
+    ),
+    "silicon": ProviderConfig(
+        name="silicon",
+        base_url="https://api.siliconflow.cn/v1",
+        api_key_env="SILICON_API_KEY",
+        default_model="deepseek-ai/DeepSeek-R1-Distill-Qwen-32B",
+        default_params={
+            "max_tokens": 4096,
+            "temperature": 0.7,
+            "top_p": 0.7,
+            "frequency_penalty": 0.5,
+            "extra_body": {"top_k": 50},
+        },
+        timeout=_env_float("LLM_SILICON_TIMEOUT", 120.0),
+        max_concurrency=_env_int("LLM_SILICON_MAX_CONCURRENCY", 8),
+    ),
+}
+
+DEFAULT_PROVIDER = os.getenv("LLM_PROVIDER") or "deepseek"
+# LLM_PROVIDER=fake replays recorded responses without network access
+FAKE_PROVIDER = "fake"
+
+# The response cache is opt-in twice: it must be enabled here, and callers must pass an entry kind
+LLM_CACHE_ENABLED = (os.getenv("LLM_CACHE_ENABLED") or "").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or "./data/cache/llm_responses.sqlite3"
+LLM_CACHE_MAX_ENTRIES = _env_int("LLM_CACHE_MAX_ENTRIES", 10000)
+LLM_CACHE_TTL = _env_float("LLM_CACHE_TTL", 86400)
+# Comma-separated entry kinds that must never be cached, to switch a kind off without a code change
+LLM_CACHE_DISABLED_KINDS = [kind.strip() for kind in (os.getenv("LLM_CACHE_DISABLED_KINDS") or "").split(",") if kind.strip()]
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the shared response cache, opening it on first use.
+
+    Returns:
+        Optional[ResponseCache]: The cache, or None when LLM_CACHE_ENABLED is off.
+    """
+    global _response_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    LLM_CACHE_PATH,
+                    max_entries=LLM_CACHE_MAX_ENTRIES,
+                    ttl=LLM_CACHE_TTL,
+                    disabled_kinds=LLM_CACHE_DISABLED_KINDS
+                )
+    return _response_cache
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """A response body that releases its concurrency slot once it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release) -> None:
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _LimitedAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    An async transport applying the limits of an LLMClient: it shares the client's semaphore, so sync and
+    async requests together stay within max_concurrency, and retries transient failures with the client's
+    jittered backoff. A slot is held until the response body is closed, which covers streamed responses.
+    """
+
+    def __init__(self, client: "LLMClient") -> None:
+        self._client = client
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=client.config.max_concurrency,
+                max_keepalive_connections=client.config.max_concurrency,
+            )
+        )
+
+    async def _acquire(self) -> None:
+        # Polling instead of waiting in a thread, so a cancelled request never takes a slot it cannot release
+        while not self._client._semaphore.acquire(blocking=False):
+            await asyncio.sleep(SEMAPHORE_POLL_INTERVAL)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        config = self._client.config
+        await self._acquire()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = await self._transport.handle_async_request(request)
+                except httpx.TransportError as e:
+                    if attempt >= config.max_retries:
+                        raise
+                    reason = e.__class__.__name__
+                else:
+                    if response.status_code not in RETRYABLE_STATUS or attempt >= config.max_retries:
+                        response.stream = _ReleasingStream(response.stream, self._client._semaphore.release)
+                        return response
+                    await response.aclose()
+                    reason = f"HTTP {response.status_code}"
+                delay = self._client._backoff(attempt)
+                logger.warning(f"{config.name} async request failed ({reason}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+        except BaseException:
+            self._client._semaphore.release()
+            raise
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class LLMClient:
+    """
+    A pooled, thread-safe client of one provider.
+
+    The underlying HTTP connection pool is created once and kept alive, so calls after the first
+    skip TCP and TLS setup. A semaphore bounds in-flight requests, and transient errors are retried
+    with exponential backoff and full jitter.
+    """
+
+    def __init__(self, config: ProviderConfig) -> None:
+        """
+        Creates the connection pool and the OpenAI client of a provider.
+
+        Args:
+            config (ProviderConfig): The provider settings.
+        """
+        self.config = config
+        self._semaphore = threading.BoundedSemaphore(config.max_concurrency)
+        self._http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=config.max_concurrency,
+                max_keepalive_connections=config.max_concurrency,
+            ),
+            timeout=config.timeout,
+        )
+        # Retries are handled here, not by the SDK, so that they respect the concurrency limit
+        self._client = OpenAI(
+            api_key=self._api_key(),
+            base_url=config.base_url,
+            http_client=self._http,
+            timeout=config.timeout,
+            max_retries=0,
+        )
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    def _api_key(self) -> str:
+        if self.config.api_key_env:
+            return os.getenv(self.config.api_key_env) or ""
+        return self.config.api_key or ""
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.config.backoff_max, self.config.backoff_base * 2 ** attempt))
+
+    def _request(self, messages: List[Dict[str, str]], model: Optional[str], stream: bool, params: Dict[str, Any]):
+        """Sends one request, retrying transient errors. The caller must hold the semaphore."""
+        request = {**self.config.default_params, **params}
+        attempt = 0
+        while True:
+            try:
+                return self._client.chat.completions.create(
+                    model=model or self.config.default_model,
+                    messages=messages,
+                    stream=stream,
+                    **request
+                ), attempt + 1
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.config.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{self.config.name} request failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def _cache_key(self, cache: Optional[str], messages: List[Dict[str, str]], model: str,
+                   params: Dict[str, Any]) -> Optional[str]:
+        """Returns the response cache key, or None when the request does not use the cache."""
+        response_cache = get_response_cache()
+        if response_cache is None or not response_cache.enabled(cache):
+            return None
+        return response_cache.key(f"{self.config.name}/{model}", messages, {**self.config.default_params, **params})
+
+    def _with_json_mode(self, params: Dict[str, Any], json_mode: bool) -> Dict[str, Any]:
+        """Adds response_format json_object when requested and supported by the provider."""
+        if json_mode and self.config.json_mode and "response_format" not in params:
+            return {**params, "response_format": {"type": "json_object"}}
+        return params
+
+    def complete(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                 cache: Optional[str] = None, json_mode: bool = False, **params: Any) -> Completion:
+        """
+        Requests a chat completion.
+
+        Args:
+            messages (List[Dict[str, str]]): The chat messages.
+            model (str, optional): The model, defaulting to the provider's default model.
+            cache (str, optional): The response cache entry kind. Identical requests of a cacheable kind are
+                answered from the cache; omit it for requests that must always reach the model.
+            json_mode (bool): Asks the provider for a JSON object response where supported; ignored otherwise.
+                The prompt must mention JSON and describe the expected object.
+            **params: Extra request parameters, overriding the provider's default_params.
+
+        Returns:
+            Completion: The completion; content is None if the request failed or the response was empty.
+        """
+        started = time.monotonic()
+        model = model or self.config.default_model
+        params = self._with_json_mode(params, json_mode)
+        cache_key = self._cache_key(cache, messages, model, params)
+        if cache_key is not None:
+            content = get_response_cache().get(cache_key)
+            if content is not None:
+                return Completion(content=content, model=model, latency=time.monotonic() - started,
+                                  attempts=0, cached=True)
+        try:
+            logger.info(f"Generating response from {self.config.name}")
+            with self._semaphore:
+                response, attempts = self._request(messages, model, False, params)
+            content = response.choices[0].message.content
+            if not content:
+                logger.error("Empty response from the model")
+            else:
+                logger.info("Successfully generated response")
+            if content and cache_key is not None:
+                get_response_cache().put(cache_key, cache, content)
+            usage = response.usage
+            return Completion(
+                content=content or None,
+                model=model,
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+                latency=time.monotonic() - started,
+                attempts=attempts,
+            )
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return Completion(content=None, model=model, latency=time.monotonic() - started)
+
+    def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+             cache: Optional[str] = None, json_mode: bool = False, **params: Any) -> Optional[str]:
+        """
+        Requests a chat completion and returns only its text.
+
+        Args:
+            messages (List[Dict[str, str]]): The chat messages.
+            model (str, optional): The model, defaulting to the provider's default model.
+            cache (str, optional): The response cache entry kind, see complete.
+            json_mode (bool): Asks for a JSON object response where supported, see complete.
+            **params: Extra request parameters.
+
+        Returns:
+            Optional[str]: The generated text, or None on failure.
+        """
+        return self.complete(messages, model, cache, json_mode, **params).content
+
+    def chat_stream(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                    cache: Optional[str] = None, json_mode: bool = False, **params: Any) -> Iterator[str]:
+        """
+        Streams a chat completion, yielding content deltas as they arrive.
+
+        Connection errors are retried before the first delta. Any other error, including a connection dropped
+        mid-stream, is logged and raised as LLMStreamError; the deltas yielded so far are then incomplete.
+        A cached response is yielded as a single delta.
+
+        Args:
+            messages (List[Dict[str, str]]): The chat messages.
+            model (str, optional): The model, defaulting to the provider's default model.
+            cache (str, optional): The response cache entry kind, see complete.
+            json_mode (bool): Asks for a JSON object response where supported, see complete.
+            **params: Extra request parameters.
+
+        Yields:
+            str: Content deltas.
+
+        Raises:
+            LLMStreamError: If the request or the stream fails.
+        """
+        params = self._with_json_mode(params, json_mode)
+        cache_key = self._cache_key(cache, messages, model or self.config.default_model, params)
+        if cache_key is not None:
+            content = get_response_cache().get(cache_key)
+            if content is not None:
+                yield content
+                return
+        try:
+            logger.info(f"Streaming response from {self.config.name}")
+            deltas = []
+            with self._semaphore:
+                stream, _ = self._request(messages, model, True, params)
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        deltas.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            if deltas and cache_key is not None:
+                get_response_cache().put(cache_key, cache, "".join(deltas))
+            logger.info("Successfully streamed response")
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            raise LLMStreamError(f"Streaming from {self.config.name} failed: {e}") from e
+
+    def start_run(self) -> None:
+        """
+        Marks the start of an agent run. The real client keeps no per-run state; replaying clients such as
+        FakeLLMClient use it to start the next script.
+        """
+
+    def async_openai(self) -> AsyncOpenAI:
+        """
+        Returns a shared AsyncOpenAI client of this provider, for async frameworks such as pydantic_ai.
+
+        Its requests count against the same max_concurrency semaphore as complete and chat_stream, and are
+        retried by the same backoff policy. The async connection pool is separate (httpx pools cannot be
+        shared between sync and async clients) but has the same size and keeps connections alive.
+
+        Returns:
+            AsyncOpenAI: The client, created on first use.
+        """
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                api_key=self._api_key(),
+                base_url=self.config.base_url,
+                http_client=httpx.AsyncClient(transport=_LimitedAsyncTransport(self), timeout=self.config.timeout),
+                timeout=self.config.timeout,
+                max_retries=0,
+            )
+        return self._async_client
+
+
+_clients: Dict[str, LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(provider: Optional[str] = None) -> LLMClient:
+    """
+    Returns the shared client of a provider, creating it on first use.
+
+    Args:
+        provider (str, optional): The provider name in PROVIDERS. Defaults to DEFAULT_PROVIDER.
+
+    Returns:
+        LLMClient: The pooled client.
+
+    Raises:
+        KeyError: If the provider is not registered.
+    """
+    name = provider or DEFAULT_PROVIDER
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                if name == FAKE_PROVIDER and name not in PROVIDERS:
+                    # Offline replay of scripted responses, see app.utils.llm.fake
+                    from app.utils.llm.fake import FakeLLMClient
+                    client = FakeLLMClient.from_env()
+                else:
+                    client = LLMClient(PROVIDERS[name])
+                _clients[name] = client
+    return client
+
+
+def register_client(name: str, client: Any) -> None:
+    """
+    Registers a ready-made client under a provider name, e.g. a FakeLLMClient for load tests.
+
+    Args:
+        name (str): The provider name.
+        client (Any): An object with the LLMClient interface (complete, chat, chat_stream, start_run).
+    """
+    with _clients_lock:
+        _clients[name] = client
+
+
+def register_provider(config: ProviderConfig) -> None:
+    """
+    Registers (or replaces) a provider. An existing client of the same name is discarded.
+
+    Args:
+        config (ProviderConfig): The provider settings.
+    """
+    with _clients_lock:
+        PROVIDERS[config.name] = config
+        _clients.pop(config.name, None)
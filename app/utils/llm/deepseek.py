@@ -1,29 +1,18 @@
-# Please install OpenAI SDK first: `pip3 install openai`
-
-from openai import OpenAI
-import os
-
-from app.utils.logging import logger
+from app.utils.llm.client import get_client
 
 
 def chat_deepseek(messages):
-    try:
-        logger.debug("messages:\n", messages[0]['content'])
-        logger.info("Generating response from DeepSeek")
-        client = OpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"), base_url="https://api.deepseek.com")
+    """Generates a response from DeepSeek through the shared, pooled client.
+
+    Returns:
+        Optional[str]: The response text, or None on failure.
+    """
+    return get_client("deepseek").chat(messages)
 
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            stream=False
-        )
 
-        if not response.choices[0].message.content:
-            logger.error("Empty response from the model")
-            return None
+def chat_deepseek_stream(messages):
+    """Streams the response from DeepSeek, yielding content deltas as they arrive.
 
-        logger.info("Successfully generated response")
-        return response.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Error generating response: {e}")
-        return None
\ No newline at end of file
+    Raises LLMStreamError if the stream fails, so a partial response is never taken as complete.
+    """
+    return get_client("deepseek").chat_stream(messages)
@@ -0,0 +1,267 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import glob
+import gzip
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from app.utils.llm.client import Completion
+from app.utils.logging import logger
+from app.utils.tokens import estimate_tokens
+
+DEFAULT_TRACE_GLOB = "./data/output/trace*.txt*"
+
+# A line that starts a new entry in an agent trace file
+_TRACE_ENTRY = re.compile(r"^(user|assistant|system): |^={10,}$|^Iteration \d+$|^Run [0-9a-f]+ at ")
+# The agent records each LLM response in its messages as "assistant: Thought: <response>"
+_THOUGHT_MARKER = "assistant: Thought:"
+
+
+class LatencyModel:
+    """
+    A distribution of simulated model latencies, in seconds.
+
+    Specs:
+        "fixed:<s>", "uniform:<low>,<high>", "normal:<mean>,<std>" (clipped at 0)
+        and "lognormal:<mu>,<sigma>" (parameters of the underlying normal distribution).
+    """
+
+    def __init__(self, kind: str = "fixed", params: Iterable[float] = (0.0,)) -> None:
+        self.kind = kind
+        self.params = list(params)
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """
+        Parses a latency spec such as "lognormal:0.0,0.5".
+
+        Args:
+            spec (str): The spec; a bare number means a fixed latency.
+
+        Returns:
+            LatencyModel: The latency model.
+
+        Raises:
+            ValueError: If the spec is malformed.
+        """
+        kind, _, params = spec.partition(":")
+        if not params:
+            return cls("fixed", [float(kind)])
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        values = [float(value) for value in params.split(",")]
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        return cls(kind, values)
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        Draws one latency.
+
+        Args:
+            rng (random.Random): The random source.
+
+        Returns:
+            float: A non-negative latency in seconds.
+        """
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(*self.params))
+        if self.kind == "lognormal":
+            return rng.lognormvariate(*self.params)
+        return self.params[0]
+
+
+def _trace_entries(paths: Iterable[str]) -> Iterator[str]:
+    """Yields the entries of agent trace files, joining multi-line entries. Rotated .gz traces are read too."""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as file:
+            entry: List[str] = []
+            for line in file:
+                line = line.rstrip("\n")
+                if _TRACE_ENTRY.match(line):
+                    if entry:
+                        yield "\n".join(entry).strip()
+                    entry = [line]
+                elif entry:
+                    entry.append(line)
+            if entry:
+                yield "\n".join(entry).strip()
+
+
+def load_trace_scripts(paths: Iterable[str]) -> List[List[str]]:
+    """
+    Extracts the LLM responses of each recorded run from agent trace files.
+
+    Args:
+        paths (Iterable[str]): Trace files written by the agent, e.g. data/output/trace*.txt*.
+
+    Returns:
+        List[List[str]]: One script per run that produced at least one response, in recorded order.
+    """
+    scripts: List[List[str]] = []
+    current: List[str] = []
+    for entry in _trace_entries(paths):
+        if entry.startswith("user: "):
+            if current:
+                scripts.append(current)
+            current = []
+        elif entry.startswith("assistant: Thought: "):
+            current.append(entry[len("assistant: Thought: "):])
+    if current:
+        scripts.append(current)
+    return scripts
+
+
+def load_trace_observations(paths: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Extracts the recorded tool observations from agent trace files.
+
+    Args:
+        paths (Iterable[str]): Trace files written by the agent.
+
+    Returns:
+        Dict[str, List[str]]: The recorded results of each tool.
+    """
+    observations: Dict[str, List[str]] = {}
+    for entry in _trace_entries(paths):
+        match = re.match(r"system: Observation from ([^:]+): (.*)", entry, re.S)
+        if match:
+            observations.setdefault(match.group(1), []).append(match.group(2))
+    return observations
+
+
+class FakeLLMClient:
+    """
+    An offline stand-in for LLMClient that replays scripted responses after a simulated latency.
+
+    Each agent run follows one script: start_run(), called by the agent when a run begins, picks the next
+    script round-robin for the current thread. Each request is answered with the script's response for the
+    step it is at (the number of previous thoughts in the prompt), so side requests such as observation
+    summaries never move the run to another script. Runs longer than their script keep receiving its last
+    response, which is normally the final answer.
+    Simulated model time is tracked per thread, so load tests can separate it from agent overhead.
+    """
+
+    def __init__(self, scripts: List[List[str]], latency: Optional[LatencyModel] = None,
+                 stream_chunk_chars: int = 16, seed: Optional[int] = None, name: str = "fake") -> None:
+        """
+        Args:
+            scripts (List[List[str]]): The response scripts, one per simulated run.
+            latency (LatencyModel, optional): The latency of one request. Defaults to no latency.
+            stream_chunk_chars (int): The size of the deltas yielded by chat_stream.
+            seed (int, optional): Seeds the latency sampling.
+            name (str): The provider name reported in logs.
+        """
+        if not scripts or not any(scripts):
+            raise ValueError("FakeLLMClient needs at least one non-empty script")
+        self.name = name
+        self.scripts = [script for script in scripts if script]
+        self.latency = latency or LatencyModel()
+        self.stream_chunk_chars = stream_chunk_chars
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._next_script = itertools.count()
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMClient":
+        """
+        Creates a client from LLM_FAKE_SCRIPT (a JSON list of scripts, or of responses forming one script)
+        or else from the traces matched by LLM_FAKE_TRACES, with latency LLM_FAKE_LATENCY.
+        """
+        script_path = os.getenv("LLM_FAKE_SCRIPT")
+        if script_path:
+            scripts = load_scripts(script_path)
+        else:
+            scripts = load_trace_scripts(sorted(glob.glob(os.getenv("LLM_FAKE_TRACES") or DEFAULT_TRACE_GLOB)))
+        return cls(scripts, LatencyModel.parse(os.getenv("LLM_FAKE_LATENCY") or "fixed:0"))
+
+    def start_run(self) -> None:
+        """
+        Starts a new agent run on the current thread, following the next script.
+        """
+        self._local.script = self.scripts[next(self._next_script) % len(self.scripts)]
+
+    def _respond(self, messages: List[Dict[str, str]]) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        step = prompt.count(_THOUGHT_MARKER)
+        if getattr(self._local, "script", None) is None:
+            self.start_run()
+        script = self._local.script
+        return script[min(step, len(script) - 1)]
+
+    def _sleep(self) -> float:
+        with self._rng_lock:
+            delay = self.latency.sample(self._rng)
+        time.sleep(delay)
+        self._local.model_seconds = self.model_seconds() + delay
+        return delay
+
+    def model_seconds(self) -> float:
+        """
+        Returns the simulated model time spent on the current thread since the last reset.
+        """
+        return getattr(self._local, "model_seconds", 0.0)
+
+    def reset_model_seconds(self) -> None:
+        """
+        Resets the current thread's simulated model time.
+        """
+        self._local.model_seconds = 0.0
+
+    def complete(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                 cache: Optional[str] = None, json_mode: bool = False, **params: Any) -> Completion:
+        """
+        Returns the next scripted response after a simulated latency. See LLMClient.complete.
+        """
+        content = self._respond(messages)
+        latency = self._sleep()
+        return Completion(
+            content=content,
+            model=model or self.name,
+            prompt_tokens=sum(estimate_tokens(message["content"]) for message in messages),
+            completion_tokens=estimate_tokens(content),
+            latency=latency,
+        )
+
+    def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+             cache: Optional[str] = None, json_mode: bool = False, **params: Any) -> Optional[str]:
+        """
+        Returns the next scripted response. See LLMClient.chat.
+        """
+        return self.complete(messages, model, cache, json_mode, **params).content
+
+    def chat_stream(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                    cache: Optional[str] = None, json_mode: bool = False, **params: Any) -> Iterator[str]:
+        """
+        Streams the next scripted response in fixed-size deltas. The simulated latency is spent before
+        the first delta. See LLMClient.chat_stream.
+        """
+        content = self._respond(messages)
+        self._sleep()
+        for start in range(0, len(content), self.stream_chunk_chars):
+            yield content[start:start + self.stream_chunk_chars]
+
+
+def load_scripts(path: str) -> List[List[str]]:
+    """
+    Loads response scripts from a JSON file holding either a list of scripts or a single list of responses.
+
+    Args:
+        path (str): The JSON file.
+
+    Returns:
+        List[List[str]]: The scripts.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    if data and all(isinstance(item, str) for item in data):
+        data = [data]
+    logger.info(f"Loaded {len(data)} fake LLM scripts from {path}")
+    return data
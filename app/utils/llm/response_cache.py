@@ -0,0 +1,169 @@
+from typing import Any, Dict, Iterable, List, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.utils.logging import logger
+
+
+class ResponseCache:
+    """
+    A persistent, size-bounded cache of LLM responses with per-entry expiry.
+
+    Keys are hashes of the model, the messages and the sampling parameters, so only byte-identical
+    requests share an entry. Entries are tagged with a kind (e.g. "recommend") that sets their TTL
+    and can be disabled as a whole. When the cache grows beyond max_entries, the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: float = 86400,
+                 ttls: Optional[Dict[str, float]] = None, disabled_kinds: Iterable[str] = ()) -> None:
+        """
+        Opens (or creates) the SQLite file backing the cache.
+
+        Args:
+            path (str): The path to the SQLite file.
+            max_entries (int): The maximum number of entries.
+            ttl (float): The default lifetime of an entry in seconds.
+            ttls (Dict[str, float], optional): Lifetimes overriding the default for some kinds.
+            disabled_kinds (Iterable[str]): Kinds that are never read from or written to the cache.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.disabled_kinds = set(disabled_kinds)
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, content TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used_at ON responses (last_used_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """
+        Computes the cache key of a request.
+
+        Args:
+            model (str): The model name.
+            messages (List[Dict[str, str]]): The chat messages.
+            params (Dict[str, Any]): The sampling parameters.
+
+        Returns:
+            str: The SHA-256 hex digest of the canonical JSON of the request.
+        """
+        payload = json.dumps({"model": model, "messages": messages, "params": params},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def enabled(self, kind: Optional[str]) -> bool:
+        """
+        Tells whether requests of a kind use the cache. Requests without a kind never do.
+
+        Args:
+            kind (str, optional): The entry kind.
+
+        Returns:
+            bool: Whether the kind is cacheable.
+        """
+        return kind is not None and kind not in self.disabled_kinds
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up an unexpired entry and marks it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, kind: str, content: str) -> None:
+        """
+        Stores a response. Every 100 writes, expired entries and the least recently used entries beyond
+        max_entries are evicted, so the cache may briefly hold up to 100 entries more than max_entries.
+
+        Args:
+            key (str): The cache key.
+            kind (str): The entry kind, which sets the TTL.
+            content (str): The response text.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, kind, content, expires_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, content, now + self.ttls.get(kind, self.ttl), now)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Removes expired entries and the least recently used ones beyond max_entries. The caller must hold the lock."""
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            logger.info(f"Response cache: evicted {count - self.max_entries} entries")
+
+    def clear(self, kind: Optional[str] = None) -> None:
+        """
+        Removes all entries, or the entries of one kind.
+
+        Args:
+            kind (str, optional): The kind to remove. Removes everything when omitted.
+        """
+        with self._lock:
+            if kind is None:
+                self._conn.execute("DELETE FROM responses")
+            else:
+                self._conn.execute("DELETE FROM responses WHERE kind = ?", (kind,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Reports cache usage.
+
+        Returns:
+            Dict[str, Any]: Entry counts per kind, capacity, hits, misses and hit rate.
+        """
+        with self._lock:
+            kinds = dict(self._conn.execute("SELECT kind, COUNT(*) FROM responses GROUP BY kind").fetchall())
+            lookups = self.hits + self.misses
+            return {
+                "size": sum(kinds.values()),
+                "kinds": kinds,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
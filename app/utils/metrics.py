@@ -0,0 +1,143 @@
+from typing import Any, Deque, Dict, Tuple
+import collections
+import json
+import threading
+
+from app.utils.logging import logger
+
+# Percentiles are computed over the most recent samples of each series
+WINDOW = 1024
+
+_LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _series(name: str, labels: Dict[str, Any]) -> _LabelKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_series(key: _LabelKey) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+
+class _Summary:
+    """Count, sum, min and max of all samples, plus a window of recent samples for percentiles."""
+
+    __slots__ = ("count", "total", "min", "max", "recent")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.recent: Deque[float] = collections.deque(maxlen=WINDOW)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def to_dict(self) -> Dict[str, float]:
+        ordered = sorted(self.recent)
+
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "mean": round(self.total / self.count, 6),
+            "min": round(self.min, 6),
+            "max": round(self.max, 6),
+            "p50": round(percentile(50), 6),
+            "p95": round(percentile(95), 6),
+            "p99": round(percentile(99), 6),
+        }
+
+
+class MetricsRegistry:
+    """
+    In-process, thread-safe aggregation of counters and value summaries.
+
+    Each series is identified by a name and a set of labels, e.g. observe("agent.tool.seconds", 0.4, tool="wikipedia").
+    Metrics live in the memory of one process and are reset on restart.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[_LabelKey, float] = collections.defaultdict(float)
+        self._summaries: Dict[_LabelKey, _Summary] = collections.defaultdict(_Summary)
+
+    def incr(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        Adds to a counter.
+
+        Args:
+            name (str): The metric name.
+            value (float): The increment.
+            **labels: The labels of the series.
+        """
+        with self._lock:
+            self._counters[_series(name, labels)] += value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """
+        Records one sample of a value, such as a latency or a size.
+
+        Args:
+            name (str): The metric name.
+            value (float): The sample.
+            **labels: The labels of the series.
+        """
+        with self._lock:
+            self._summaries[_series(name, labels)].add(value)
+
+    def snapshot(self, prefix: str = "") -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the current values of all series.
+
+        Args:
+            prefix (str): Only include metrics whose name starts with this prefix.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: "counters" maps each series to its value, "summaries" maps each series
+                to its count, sum, mean, min, max and p50/p95/p99 of the recent samples.
+                Series are keyed like "agent.tool.seconds{tool=wikipedia}".
+        """
+        with self._lock:
+            return {
+                "counters": {
+                    _format_series(key): value
+                    for key, value in sorted(self._counters.items()) if key[0].startswith(prefix)
+                },
+                "summaries": {
+                    _format_series(key): summary.to_dict()
+                    for key, summary in sorted(self._summaries.items()) if key[0].startswith(prefix)
+                },
+            }
+
+    def reset(self) -> None:
+        """
+        Drops all series.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+metrics = MetricsRegistry()
+
+
+def log_event(event: str, **fields: Any) -> None:
+    """
+    Writes a structured log line: a JSON object with the event name and its fields.
+
+    Args:
+        event (str): The event name, e.g. "agent.llm".
+        **fields: The event fields.
+    """
+    logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
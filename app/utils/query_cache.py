@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+import threading
+import time
+
+
+class QueryCache:
+    """
+    A thread-safe, size-bounded LRU cache whose entries expire after a fixed TTL.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300) -> None:
+        """
+        Initializes an empty cache.
+
+        Args:
+            maxsize (int): The maximum number of entries; the least recently used entry is evicted first.
+            ttl (float): The lifetime of an entry in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Looks up an entry and marks it as recently used.
+
+        Args:
+            key (Hashable): The cache key.
+
+        Returns:
+            Optional[Any]: The cached value, or None on a miss or an expired entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Stores an entry, evicting the least recently used entries beyond maxsize.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value to cache.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Removes all entries. Hit and miss counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Reports cache usage.
+
+        Returns:
+            Dict[str, Any]: Entry count, capacity, hits, misses and hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,227 @@
+from typing import Dict, List, Optional
+import atexit
+import contextlib
+import glob
+import gzip
+import os
+import shutil
+import threading
+import time
+
+from app.utils.logging import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within the process
+    fcntl = None
+
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES") or 10 * 1024 * 1024)
+TRACE_MAX_AGE = float(os.getenv("TRACE_MAX_AGE") or 86400)
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS") or 10)
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL") or 1.0)
+TRACE_MAX_BUFFER_BYTES = int(os.getenv("TRACE_MAX_BUFFER_BYTES") or 8 * 1024 * 1024)
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Holds an exclusive lock on a lock file, shared by all processes writing the same trace."""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class TraceWriter:
+    """
+    Appends trace records to a file from a background thread.
+
+    write() only adds the record to an in-memory buffer, so callers never wait for the disk. The buffer is
+    flushed every flush_interval seconds, or sooner when it is half full, in a single append. Each record is
+    written contiguously, so records from concurrent runs never interleave.
+
+    The file is rotated once it would grow beyond max_bytes or is older than max_age: it is renamed to
+    <stem>-<timestamp><ext>, gzip-compressed, and only the newest `backups` rotated files are kept.
+    Appends and rotation are serialized by a lock file (.<name>.lock), so several processes may write the
+    same trace; its modification time marks the last rotation.
+    """
+
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES, max_age: float = TRACE_MAX_AGE,
+                 backups: int = TRACE_BACKUPS, flush_interval: float = TRACE_FLUSH_INTERVAL,
+                 max_buffer_bytes: int = TRACE_MAX_BUFFER_BYTES, compress: bool = True) -> None:
+        """
+        Args:
+            path (str): The trace file.
+            max_bytes (int): The size that triggers a rotation.
+            max_age (float): The age in seconds that triggers a rotation.
+            backups (int): The number of rotated files to keep.
+            flush_interval (float): The longest time a record stays in memory, in seconds.
+            max_buffer_bytes (int): The buffer limit; records beyond it are dropped and counted in `dropped`.
+            compress (bool): Whether to gzip rotated files.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.max_buffer_bytes = max_buffer_bytes
+        self.compress = compress
+        self.dropped = 0
+        directory, name = os.path.split(path)
+        self._directory = directory or "."
+        self._stem, self._ext = os.path.splitext(name)
+        self._lock_path = os.path.join(self._directory, f".{name}.lock")
+        self._buffer: List[str] = []
+        self._buffered_bytes = 0
+        self._buffer_lock = threading.Lock()
+        # Held for a whole flush, so batches reach the file in the order they were taken from the buffer
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self, record: str) -> None:
+        """
+        Queues a record for writing. Never blocks on the disk.
+
+        Args:
+            record (str): The text to append, including its trailing newline.
+        """
+        size = len(record.encode("utf-8"))
+        with self._buffer_lock:
+            if self._buffered_bytes + size > self.max_buffer_bytes:
+                self.dropped += 1
+                return
+            self._buffer.append(record)
+            self._buffered_bytes += size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._thread.start()
+            full = self._buffered_bytes >= self.max_buffer_bytes // 2
+        if full:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"Error flushing trace {self.path}")
+
+    def flush(self) -> None:
+        """
+        Writes all buffered records to the file now, rotating it first if needed.
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                records, self._buffer = self._buffer, []
+                self._buffered_bytes = 0
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                logger.warning(f"Trace buffer of {self.path} was full: dropped {dropped} records")
+            if not records:
+                return
+            data = "".join(records).encode("utf-8")
+
+            os.makedirs(self._directory, exist_ok=True)
+            rotated = None
+            with _file_lock(self._lock_path):
+                if self._should_rotate(len(data)):
+                    rotated = self._rotate()
+                with open(self.path, "ab") as file:
+                    file.write(data)
+            # 压缩和清理旧文件不需要持有文件锁
+            if rotated is not None:
+                self._finish_rotation(rotated)
+
+    def _should_rotate(self, incoming: int) -> bool:
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return False
+        if size == 0:
+            return False
+        if size + incoming > self.max_bytes:
+            return True
+        return time.time() - os.path.getmtime(self._lock_path) >= self.max_age
+
+    def _rotate(self) -> str:
+        """Moves the current file aside and returns its new path. The caller must hold the file lock."""
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        rotated = os.path.join(self._directory, f"{self._stem}-{stamp}{self._ext}")
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated = os.path.join(self._directory, f"{self._stem}-{stamp}.{suffix}{self._ext}")
+            suffix += 1
+        if self.compress:
+            # 压缩完成前使用隐藏文件名，避免按trace*.txt*匹配的读取方读到不完整的文件
+            staging = os.path.join(self._directory, "." + os.path.basename(rotated))
+            os.replace(self.path, staging)
+            open(rotated + ".gz", "wb").close()  # reserve the name for concurrent rotations
+        else:
+            staging = rotated
+            os.replace(self.path, rotated)
+        os.utime(self._lock_path)
+        logger.info(f"Rotated trace {self.path} to {rotated}")
+        return staging
+
+    def _finish_rotation(self, staging: str) -> None:
+        if self.compress:
+            compressed = os.path.join(self._directory, os.path.basename(staging)[1:] + ".gz")
+            with open(staging, "rb") as source, gzip.open(staging + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.replace(staging + ".gz", compressed)
+            os.remove(staging)
+        pattern = os.path.join(self._directory, f"{self._stem}-*{self._ext}" + (".gz" if self.compress else ""))
+        for old in sorted(glob.glob(pattern), key=os.path.getmtime)[:-self.backups or None]:
+            os.remove(old)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Reports the buffer state.
+
+        Returns:
+            Dict[str, int]: The buffered records and bytes, and the records dropped since the last flush.
+        """
+        with self._buffer_lock:
+            return {"buffered": len(self._buffer), "buffered_bytes": self._buffered_bytes, "dropped": self.dropped}
+
+
+_writers: Dict[str, TraceWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_trace_writer(path: str) -> TraceWriter:
+    """
+    Returns the process-wide writer of a trace file, creating it with the TRACE_* settings on first use.
+
+    Args:
+        path (str): The trace file.
+
+    Returns:
+        TraceWriter: The writer shared by every caller using the same file.
+    """
+    key = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = TraceWriter(path)
+        return writer
+
+
+@atexit.register
+def flush_all() -> None:
+    """
+    Flushes every trace writer; runs at interpreter exit so buffered records are not lost.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        try:
+            writer.flush()
+        except Exception:
+            logger.exception(f"Error flushing trace {writer.path}")
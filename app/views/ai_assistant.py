@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify, flash
+from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify, flash, Response
 from app.models.user import User
 from app.models.chat import Chat, ChatMessage
 from app.react.agent import run
+from app.services.chat_history_service import ChatHistoryService
+from app.services.agent_job_service import AgentJobService
+from app.utils.job_queue import JobRejected
+from app.views.jobs import stream_job
 from app.ext import db
+from peewee import IntegrityError
+import datetime
 import json
 
 ai_assistant_bp = Blueprint('ai_assistant', __name__, url_prefix='/ai-assistant')
@@ -93,66 +99,239 @@ def get_messages(chat_id):
     except Chat.DoesNotExist:
         return jsonify({'error': '聊天不存在或无权访问'}), 404
 
-@ai_assistant_bp.route('/chats/<int:chat_id>/messages', methods=['POST'])
-def send_message(chat_id):
-    """发送新消息并获取AI回复"""
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录'}), 401
+# 同一幂等键的消息在此时间内没有回复，视为仍在处理中；超过后允许重试重新生成回复
+IDEMPOTENCY_PENDING_SECONDS = 300
+
+def _idempotency_key(data):
+    """从请求头Idempotency-Key或请求体idempotency_key中读取幂等键"""
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    return str(key)[:64] if key else None
+
+def _message_dict(message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def _begin_turn(chat, content, key):
+    """在一个短事务中记录用户消息。
     
-    user_id = session['user_id']
-    user = User.get_by_id(user_id)
-    data = request.get_json()
+    带幂等键的重复请求不会再次记录消息：已有回复时返回该回复，回复仍在生成中时标记为pending。
     
-    if not data or 'message' not in data:
-        return jsonify({'error': '消息不能为空'}), 400
+    Args:
+        chat (Chat): 聊天会话
+        content (str): 用户消息内容
+        key (str): 幂等键，可以为None
     
+    Returns:
+        tuple: (user_message, ai_message, pending, created)，ai_message为已有的回复或None，
+            created表示用户消息是否由本次请求记录
+    """
+    def existing():
+        user_message = ChatMessage.get_or_none(
+            ChatMessage.chat == chat,
+            ChatMessage.role == ChatMessage.ROLE_USER,
+            ChatMessage.idempotency_key == key
+        )
+        if not user_message:
+            return None
+        ai_message = ChatMessage.get_or_none(
+            ChatMessage.chat == chat,
+            ChatMessage.role == ChatMessage.ROLE_ASSISTANT,
+            ChatMessage.idempotency_key == key
+        )
+        elapsed = (datetime.datetime.now() - user_message.timestamp).total_seconds()
+        return user_message, ai_message, ai_message is None and elapsed < IDEMPOTENCY_PENDING_SECONDS, False
+    
+    if key:
+        turn = existing()
+        if turn:
+            return turn
     try:
-        # 使用事务确保原子性
         with db.atomic():
-            # 确保聊天存在且属于当前用户
-            chat = Chat.get_or_none(Chat.id == chat_id, Chat.user == user)
-            
-            if not chat:
-                return jsonify({'error': '聊天不存在或无权访问'}), 404
-            
-            # 记录用户消息
             user_message = ChatMessage.create(
                 chat=chat,
                 role=ChatMessage.ROLE_USER,
-                content=data['message']
+                content=content,
+                idempotency_key=key
             )
-            
-            history_messages = ChatMessage.select().where(ChatMessage.chat == chat).order_by(ChatMessage.timestamp)
+        return user_message, None, False, True
+    except IntegrityError:
+        # 相同幂等键的并发请求已经记录了消息
+        turn = existing() if key else None
+        if not turn:
+            raise
+        user_message, ai_message, _, _ = turn
+        return user_message, ai_message, ai_message is None, False
 
-            # 调用AI模型生成回复
-            # TODO: 选择权限最高的角色
-            ai_response = run(data['message'], user.roles[0].role.name, history_messages)
-            
-            # 记录AI回复
+def _finish_turn(chat, content, answer, key):
+    """在一个短事务中记录AI回复，并在第一条消息时更新聊天标题。
+    
+    Returns:
+        ChatMessage: AI回复；相同幂等键的回复已被并发写入时返回已有的回复
+    """
+    try:
+        with db.atomic():
             ai_message = ChatMessage.create(
                 chat=chat,
                 role=ChatMessage.ROLE_ASSISTANT,
-                content=ai_response
+                content=answer,
+                idempotency_key=key
             )
             
             # 更新聊天标题 - 只在第一条消息时更新
             if chat.title == "新会话":
                 # 使用用户的第一条消息作为聊天标题
-                chat.title = data['message'][:30] + ('...' if len(data['message']) > 30 else '')
-                chat.save()
+                chat.title = content[:30] + ('...' if len(content) > 30 else '')
+                # 只保存标题，避免覆盖后台线程写入的摘要
+                chat.save(only=[Chat.title, Chat.updated_at])
+    except IntegrityError:
+        if not key:
+            raise
+        return ChatMessage.get(
+            ChatMessage.chat == chat,
+            ChatMessage.role == ChatMessage.ROLE_ASSISTANT,
+            ChatMessage.idempotency_key == key
+        )
+    
+    ChatHistoryService.schedule_summary(chat.id)
+    return ai_message
+
+def _sse(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _run_turn(job, chat, user_message, role, history_messages, key):
+    """在后台任务中运行agent并记录AI回复，进度事件推送到任务中"""
+    try:
+        result = run(user_message.content, role, history_messages,
+                     on_event=lambda event, payload: job.publish(event, payload))
+        
+        # 第二次写入：记录AI回复
+        ai_message = _finish_turn(chat, user_message.content, result.answer, key)
+    except Exception as e:
+        print(f'处理消息时发生错误: {str(e)}')
+        job.publish('error', {'error': f'处理消息时发生错误: {str(e)}'})
+        raise
+    
+    reply = {
+        'user_message': _message_dict(user_message),
+        'ai_message': _message_dict(ai_message),
+        # completed / budget_exhausted / error
+        'status': result.status
+    }
+    job.publish('done', {'ai_message': reply['ai_message'], 'status': reply['status']})
+    return reply
+
+def _submit_turn(chat, user, data):
+    """记录用户消息并提交生成回复的agent任务
+    
+    Returns:
+        tuple: (user_message, ai_message, job, error_response)。重复请求已有回复时ai_message非None；
+            请求无法处理时error_response为(响应体, 状态码)
+    """
+    key = _idempotency_key(data)
+    # 第一次写入：记录用户消息
+    user_message, ai_message, pending, created = _begin_turn(chat, data['message'], key)
+    if ai_message:
+        return user_message, ai_message, None, None
+    if pending:
+        return user_message, None, None, ({'error': '该消息正在处理中，请稍后重试'}, 409)
+    
+    # 滚动摘要加上token预算内的近期消息，提示词长度不随会话变长而增长
+    history_messages = ChatHistoryService.get_history(chat, exclude_message_id=user_message.id)
+    # TODO: 选择权限最高的角色
+    role = user.roles[0].role.name
+    
+    try:
+        job = AgentJobService.submit('chat', user.id, _run_turn, chat, user_message, role, history_messages, key)
+    except JobRejected as e:
+        # 任务未被接受，撤销本次请求记录的用户消息，客户端可以用同一个幂等键重试；
+        # 重试超时的旧消息时复用的是之前记录的消息，不能删除
+        if created:
+            user_message.delete_instance()
+        return user_message, None, None, AgentJobService.rejection_response(e)
+    return user_message, None, job, None
+
+@ai_assistant_bp.route('/chats/<int:chat_id>/messages', methods=['POST'])
+def send_message(chat_id):
+    """发送新消息，AI回复在后台任务中生成
+    
+    返回202和任务ID，客户端通过GET /jobs/<job_id>轮询或GET /jobs/<job_id>/events订阅结果，
+    任务结果包含user_message、ai_message和status。
+    用户消息和AI回复分别在两个短事务中写入，agent运行期间不占用请求线程、事务和数据库连接。
+    客户端可以通过Idempotency-Key请求头(或请求体中的idempotency_key)重试，不会产生重复消息。
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    
+    user_id = session['user_id']
+    user = User.get_by_id(user_id)
+    data = request.get_json()
+    
+    if not data or 'message' not in data:
+        return jsonify({'error': '消息不能为空'}), 400
+    
+    try:
+        # 确保聊天存在且属于当前用户
+        chat = Chat.get_or_none(Chat.id == chat_id, Chat.user == user)
+        
+        if not chat:
+            return jsonify({'error': '聊天不存在或无权访问'}), 404
+        
+        user_message, ai_message, job, error = _submit_turn(chat, user, data)
+        if error:
+            return jsonify(error[0]), error[1]
+        if ai_message:
+            # 重复请求，直接返回已有的回复
+            return jsonify({
+                'user_message': _message_dict(user_message),
+                'ai_message': _message_dict(ai_message),
+                'status': 'completed'
+            })
         
         return jsonify({
-            'user_message': {
-                'id': user_message.id,
-                'content': user_message.content,
-                'timestamp': user_message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            },
-            'ai_message': {
-                'id': ai_message.id,
-                'content': ai_message.content,
-                'timestamp': ai_message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            }
-        })
+            'user_message': _message_dict(user_message),
+            'job': job.to_dict()
+        }), 202
     except Exception as e:
         print(f'处理消息时发生错误: {str(e)}')
         return jsonify({'error': f'处理消息时发生错误: {str(e)}'}), 500
+
+@ai_assistant_bp.route('/chats/<int:chat_id>/messages/stream', methods=['POST'])
+def stream_message(chat_id):
+    """发送新消息，并通过Server-Sent Events实时推送AI的思考、工具调用、观察结果和最终回答
+    
+    agent在后台任务中运行，本接口订阅该任务的进度事件；连接断开后可以通过GET /jobs/<job_id>/events继续订阅。
+    事件类型: user_message, token, thought, action, observation, answer, done, error, job
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    
+    user_id = session['user_id']
+    user = User.get_by_id(user_id)
+    data = request.get_json()
+    
+    if not data or 'message' not in data:
+        return jsonify({'error': '消息不能为空'}), 400
+    
+    chat = Chat.get_or_none(Chat.id == chat_id, Chat.user == user)
+    if not chat:
+        return jsonify({'error': '聊天不存在或无权访问'}), 404
+    
+    user_message, ai_message, job, error = _submit_turn(chat, user, data)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    def replay():
+        # 重复请求，直接返回已有的回复
+        yield _sse('user_message', _message_dict(user_message))
+        yield _sse('done', {'ai_message': _message_dict(ai_message), 'status': 'completed'})
+    
+    stream = replay() if ai_message else stream_job(
+        job, prelude=[('user_message', dict(_message_dict(user_message), job_id=job.id))])
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 禁止反向代理缓冲
+    })
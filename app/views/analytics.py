@@ -4,6 +4,9 @@ from app.services.course_service import CourseService
 from app.models.user import User
 from app.models.course import Course
 from app.utils.result import Result  # 导入Result类
+from app.services.agent_job_service import AgentJobService
+from app.utils.job_queue import JobRejected
+from app.react.tools.analyze_agent import learning_analyze
 
 analytics_bp = Blueprint('analytics', __name__, url_prefix='/analytics')
 
@@ -127,3 +130,27 @@ def record_activity():
         return jsonify(success=True)
     except Exception as e:
         return jsonify(success=False, message=str(e)), 400
+
+@analytics_bp.route('/ask', methods=['POST'])
+def ask_analysis():
+    """向学情分析agent提问的API端点
+    
+    分析在后台任务中运行，返回202和任务信息，客户端通过GET /jobs/<job_id>轮询或GET /jobs/<job_id>/events订阅结果。
+    请求体: {"question": "...", "dataset": "knowledge_mastery" | "learning_activity" | "assignment"}
+    """
+    if 'user_id' not in session:
+        return jsonify(success=False, message="未登录"), 401
+    
+    data = request.json or {}
+    question = data.get('question')
+    dataset = data.get('dataset')
+    if not question or dataset not in ('knowledge_mastery', 'learning_activity', 'assignment'):
+        return jsonify(success=False, message="问题不能为空，且dataset必须是knowledge_mastery、learning_activity或assignment"), 400
+    
+    try:
+        job = AgentJobService.submit('analysis', session['user_id'],
+                                     lambda job: learning_analyze(question, dataset))
+    except JobRejected as e:
+        body, status = AgentJobService.rejection_response(e)
+        return jsonify(success=False, message=body['error'], reason=body['reason']), status
+    return jsonify(success=True, job=job.to_dict()), 202
@@ -0,0 +1,91 @@
+from flask import Blueprint, session, request, jsonify, Response
+from app.models.user import User
+from app.services.agent_job_service import AgentJobService
+from app.services.user_service import UserService
+from app.utils.metrics import metrics
+import json
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """轮询agent任务的状态和结果
+
+    status: queued / running / succeeded / failed；succeeded时result为任务结果，failed时error为错误信息
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+
+    job = AgentJobService.get_job(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+
+    return jsonify(job.to_dict())
+
+@jobs_bp.route('/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """通过Server-Sent Events订阅agent任务的进度事件，任务结束时推送job事件后关闭连接
+
+    断线重连时浏览器会带上Last-Event-ID，从下一条事件继续推送
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+
+    job = AgentJobService.get_job(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+
+    try:
+        after = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        after = 0
+
+    return Response(stream_job(job, after), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 禁止反向代理缓冲
+    })
+
+def stream_job(job, after=0, prelude=()):
+    """将任务的进度事件格式化为SSE流，结束时推送包含最终状态的job事件
+
+    Args:
+        job (Job): 任务
+        after (int): 从第几条事件开始推送
+        prelude (Iterable): 在任务事件之前推送的(event, data)
+    """
+    for event, data in prelude:
+        yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    for index, event, data in job.subscribe(after):
+        if event == 'ping':
+            # 注释行作为心跳，防止代理断开空闲连接
+            yield ": ping\n\n"
+            continue
+        yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    yield f"event: job\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+
+@jobs_bp.route('/stats', methods=['GET'])
+def job_stats():
+    """查看agent任务队列的使用情况(仅管理员)"""
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+
+    user = User.get_by_id(session['user_id'])
+    if not UserService.has_role(user, 'admin'):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    return jsonify(AgentJobService.stats())
+
+@jobs_bp.route('/metrics', methods=['GET'])
+def agent_metrics():
+    """查看agent的聚合指标(仅管理员)：LLM延迟与token用量、各工具耗时与观察结果大小、提示词各部分的token数、每次运行的迭代次数
+
+    可用prefix参数筛选指标，如?prefix=agent.tool
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+
+    user = User.get_by_id(session['user_id'])
+    if not UserService.has_role(user, 'admin'):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    return jsonify(metrics.snapshot(request.args.get('prefix', 'agent.')))
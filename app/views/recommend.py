@@ -1,5 +1,7 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash, jsonify
 from app.services.recommend_service import RecommendService
+from app.services.agent_job_service import AgentJobService
+from app.utils.job_queue import JobRejected
 
 recommend_bp = Blueprint('recommend', __name__, url_prefix='/recommend')
 
@@ -13,10 +15,23 @@ def index():
     return render_template('recommend/index.html')
 
 
+def _submit_recommendation(func, *args):
+    """在后台任务中生成推荐，返回202和任务信息，前端通过GET /jobs/<job_id>轮询结果"""
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+
+    try:
+        job = AgentJobService.submit('recommend', session['user_id'], lambda job, *task_args: func(*task_args), *args)
+    except JobRejected as e:
+        body, status = AgentJobService.rejection_response(e)
+        return jsonify(body), status
+    return jsonify({'job': job.to_dict()}), 202
+
+
 @recommend_bp.route('/history', methods=['GET'])
 def recommend_by_history():
-    return RecommendService.get_recommendations_by_history()
+    return _submit_recommendation(RecommendService.get_recommendations_by_history)
 
 @recommend_bp.route('/req/<subject>/<chapter>', methods=['GET'])
 def recommend_by_req(subject, chapter):
-    return RecommendService.get_recommendations_by_requirement(subject, chapter)
+    return _submit_recommendation(RecommendService.get_recommendations_by_requirement, subject, chapter)
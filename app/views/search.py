@@ -13,6 +13,8 @@ def index():
     
     query = request.args.get('q', '')
     course_id = request.args.get('course_id')
+    # mode=hybrid时同时使用词法检索，适合精确术语
+    hybrid = request.args.get('mode') == 'hybrid'
     
     if course_id:
         try:
@@ -22,7 +24,7 @@ def index():
     
     results = []
     if query:
-        results = KnowledgeBaseService.search_knowledge(query, course_id)
+        results = KnowledgeBaseService.search_knowledge(query, course_id, hybrid=hybrid)
     
     # 获取用户课程，用于筛选
     user_id = session['user_id']
@@ -48,6 +50,9 @@ def api_search():
     query = request.args.get('q', '')
     course_id = request.args.get('course_id')
     limit = int(request.args.get('limit', 5))
+    category = request.args.get('category') or None
+    tags = [tag.strip() for tag in request.args.get('tags', '').split(',') if tag.strip()]
+    hybrid = request.args.get('mode') == 'hybrid'
     
     if course_id:
         try:
@@ -57,7 +62,9 @@ def api_search():
     
     results = []
     if query:
-        results = KnowledgeBaseService.search_knowledge(query, course_id, limit)
+        # 该接口不返回完整记录，使用带缓存的搜索
+        results = KnowledgeBaseService.cached_search(query, course_id, limit,
+                                                     category=category, tags=tags, hybrid=hybrid)
         
     # 将结果转换为简单的JSON结构
     simplified_results = []
@@ -72,6 +79,18 @@ def api_search():
     
     return jsonify({"results": simplified_results})
 
+@search_bp.route('/api/cache-stats')
+def api_cache_stats():
+    """API端点, 查看搜索结果缓存的命中率"""
+    if 'user_id' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    user = User.get_by_id(session['user_id'])
+    if not UserService.has_role(user, 'admin'):
+        return jsonify({"error": "Forbidden"}), 403
+    
+    return jsonify(KnowledgeBaseService.search_cache_stats())
+
 @search_bp.route('/manage')
 def manage_knowledge():
     """管理知识库条目"""
@@ -195,18 +214,16 @@ def edit_knowledge(knowledge_id):
         tags = [tag.strip() for tag in tags if tag.strip()]
         
         try:
+            # 课程关联也需要同步到向量数据库的元数据
             KnowledgeBaseService.update_knowledge(
                 knowledge_id=knowledge_id,
                 title=title,
                 content=content,
                 category=category,
-                tags=tags
+                tags=tags,
+                course_id=course_id
             )
             
-            # 更新课程关联
-            entry.course_id = course_id
-            entry.save()
-            
             flash('知识条目已更新。', 'success')
             return redirect(url_for('search.manage_knowledge'))
         except Exception as e:
@@ -0,0 +1,176 @@
+"""ReAct Agent负载测试。
+
+用离线的FakeLLMClient回放脚本化的响应(默认为data/output/trace*.txt*中记录的响应)，
+以N个并发模拟用户反复调用run()，分别统计模型时间(模拟延迟)和agent自身的开销
+(提示词构造、响应解析、工具调度、轨迹写入等)。不需要访问DeepSeek。
+
+用法:
+    python -m scripts.benchmark_agent --users 8 --runs 20 --latency lognormal:0.0,0.5
+    python -m scripts.benchmark_agent --script responses.json --latency fixed:0 --tools replay
+
+--tools replay(默认)用轨迹中记录的观察结果代替真实工具，不访问数据库和网络；
+--tools live调用真实工具，需要数据库，并以--user-id指定的用户身份运行。
+overhead = 单次运行耗时 - 模型时间，包含工具耗时；--tool-latency为0时即为agent循环本身的开销。
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.llm.client import register_client
+from app.utils.llm.fake import FakeLLMClient, LatencyModel, load_scripts, load_trace_observations, load_trace_scripts
+from app.utils.metrics import metrics
+
+FAKE_PROVIDER = "benchmark"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(values):
+    return {
+        "mean": round(statistics.mean(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+    }
+
+
+def replay_tools(tools, observations, latency, seed):
+    """用记录的观察结果代替工具函数，没有记录的工具返回固定文本。"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def make(name):
+        recorded = observations.get(name) or [f"(no recorded observation for {name})"]
+
+        def replay(params):
+            with lock:
+                delay = latency.sample(rng)
+                result = rng.choice(recorded)
+            time.sleep(delay)
+            return result
+        return replay
+
+    return {name: dict(tool, function=make(name)) for name, tool in tools.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ReAct Agent负载测试")
+    parser.add_argument("--users", type=int, default=8, help="并发模拟用户数")
+    parser.add_argument("--runs", type=int, default=10, help="每个用户的运行次数")
+    parser.add_argument("--latency", default="lognormal:0.0,0.5", help="模型延迟分布，如fixed:0.5、uniform:0.2,2、normal:1,0.3、lognormal:0,0.5")
+    parser.add_argument("--script", help="JSON格式的响应脚本；不指定时使用--traces中的轨迹")
+    parser.add_argument("--traces", default="./data/output/trace*.txt*", help="记录的agent轨迹文件(包括轮转压缩后的.gz文件)")
+    parser.add_argument("--tools", default="replay", choices=["replay", "live"], help="工具执行方式")
+    parser.add_argument("--tool-latency", default="fixed:0", help="--tools replay时每次工具调用的延迟分布")
+    parser.add_argument("--role", default="teacher", choices=["student", "teacher", "admin"], help="运行agent的角色")
+    parser.add_argument("--user-id", type=int, help="--tools live时会话中的用户ID")
+    parser.add_argument("--query", default="请帮我分析一下学生的学习情况。", help="发送给agent的问题")
+    parser.add_argument("--stream", action="store_true", help="以流式方式调用模型(设置on_event)")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output", help="将结果以JSON写入该文件")
+    args = parser.parse_args()
+
+    trace_paths = sorted(glob.glob(args.traces))
+    scripts = load_scripts(args.script) if args.script else load_trace_scripts(trace_paths)
+    fake = FakeLLMClient(scripts, LatencyModel.parse(args.latency), seed=args.seed)
+    register_client(FAKE_PROVIDER, fake)
+
+    import app.react.agent as agent_module
+    from app.react import tools_register
+
+    # 轨迹写入临时文件，不污染data/output/trace.txt
+    trace_directory = tempfile.mkdtemp(prefix="agent-bench-")
+    agent_module.OUTPUT_TRACE_PATH = os.path.join(trace_directory, "trace.txt")
+
+    if args.tools == "replay":
+        observations = load_trace_observations(trace_paths)
+        tool_latency = LatencyModel.parse(args.tool_latency)
+        for name in ("student_tools", "teacher_tools", "admin_tools"):
+            tools = getattr(tools_register, name)
+            replayed = replay_tools(tools, observations, tool_latency, args.seed)
+            tools.clear()
+            tools.update(replayed)
+        flask_app = None
+    else:
+        from app import create_app
+        flask_app = create_app()
+
+    def simulate_user(user_index):
+        outcomes = []
+        context = None
+        if flask_app is not None:
+            from flask import session
+            context = flask_app.test_request_context()
+            context.push()
+            session["user_id"] = args.user_id
+        try:
+            for _ in range(args.runs):
+                fake.reset_model_seconds()
+                started = time.perf_counter()
+                result = agent_module.run(
+                    args.query, args.role, provider=FAKE_PROVIDER,
+                    on_event=(lambda event, data: None) if args.stream else None
+                )
+                wall = time.perf_counter() - started
+                outcomes.append({
+                    "wall": wall,
+                    "model": fake.model_seconds(),
+                    "status": result.status,
+                    "iterations": result.iterations,
+                    "llm_calls": result.llm_calls,
+                    "json_repairs": result.json_repairs,
+                    "reasks": result.reasks,
+                })
+        finally:
+            if context is not None:
+                context.pop()
+        return outcomes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        outcomes = [outcome for user_outcomes in executor.map(simulate_user, range(args.users))
+                    for outcome in user_outcomes]
+    elapsed = time.perf_counter() - started
+
+    llm_calls = sum(outcome["llm_calls"] for outcome in outcomes)
+    overheads = [outcome["wall"] - outcome["model"] for outcome in outcomes]
+    report = {
+        "users": args.users,
+        "runs": len(outcomes),
+        "latency": args.latency,
+        "tools": args.tools,
+        "scripts": len(fake.scripts),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_runs_per_second": round(len(outcomes) / elapsed, 2),
+        "statuses": dict(collections.Counter(outcome["status"] for outcome in outcomes)),
+        "mean_iterations": round(statistics.mean(outcome["iterations"] for outcome in outcomes), 2),
+        "llm_calls": llm_calls,
+        "json_repairs": sum(outcome["json_repairs"] for outcome in outcomes),
+        "reasks": sum(outcome["reasks"] for outcome in outcomes),
+        "run_seconds": summarize([outcome["wall"] for outcome in outcomes]),
+        "model_seconds": summarize([outcome["model"] for outcome in outcomes]),
+        "overhead_seconds": summarize(overheads),
+        "overhead_ms_per_llm_call": round(sum(overheads) / max(llm_calls, 1) * 1000, 3),
+        # agent内部的细分指标：各工具耗时、提示词各部分的token数等
+        "metrics": metrics.snapshot("agent."),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""知识库检索性能基准测试。
+
+在临时的Chroma目录中生成中文和英文合成语料，测量索引速度、检索延迟(p50/p95/p99)、吞吐量、
+磁盘占用，以及相对暴力检索真值的recall@k。不需要数据库，也不会修改chroma_db/。
+
+检索走KnowledgeBaseService.search_knowledge的完整路径。索引速度(index_seconds/index_rate)
+只覆盖向量和词法索引的写入：按服务的方式分块、嵌入并写入Chroma和词法索引，不包括
+bulk_add_knowledge中的数据库写入和断点记录，因此不能代表scripts.import_knowledge的端到端导入速度。
+
+用法:
+    python -m scripts.benchmark_knowledge_base --sizes 10000 100000 1000000 --languages zh en
+
+--embedding hash(默认)使用特征哈希嵌入，速度快，适合测量大规模下的索引开销；
+--embedding model使用实际的嵌入模型，更接近线上表现，但百万级语料需要数小时。
+暴力检索真值需要在内存中保存全部嵌入向量，百万级语料约占用1.5GB内存。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from chromadb import PersistentClient
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+from app import ext
+from app.utils.embedding_cache import EmbeddingCache
+from app.utils.lexical_index import LexicalIndex, tokenize
+
+EMBEDDING_DIM = 384
+COURSE_COUNT = 50
+
+ZH_TERMS = [
+    "快速排序", "归并排序", "时间复杂度", "空间复杂度", "二叉树", "红黑树", "哈希表", "动态规划",
+    "贪心算法", "图论", "最短路径", "最小生成树", "线性代数", "特征值", "矩阵分解", "概率论",
+    "贝叶斯公式", "大数定律", "中心极限定理", "微积分", "泰勒展开", "傅里叶变换", "拉格朗日乘数",
+    "梯度下降", "反向传播", "卷积神经网络", "循环神经网络", "注意力机制", "操作系统", "进程调度",
+    "虚拟内存", "死锁", "计算机网络", "TCP协议", "拥塞控制", "数据库", "事务隔离", "索引结构",
+    "编译原理", "语法分析", "有限自动机", "正则表达式", "离散数学", "命题逻辑", "集合论", "组合数学",
+]
+ZH_FILLERS = ["的定义是", "主要用于", "可以通过", "与", "相比", "在课堂上", "常见的例子是", "需要注意",
+              "推导过程", "适用于", "的性质", "证明方法"]
+EN_TERMS = [
+    "quicksort", "merge sort", "time complexity", "space complexity", "binary tree", "red-black tree",
+    "hash table", "dynamic programming", "greedy algorithm", "graph theory", "shortest path",
+    "spanning tree", "linear algebra", "eigenvalue", "matrix factorization", "probability", "Bayes rule",
+    "law of large numbers", "central limit theorem", "calculus", "Taylor series", "Fourier transform",
+    "Lagrange multiplier", "gradient descent", "backpropagation", "convolutional network",
+    "recurrent network", "attention", "operating system", "process scheduling", "virtual memory",
+    "deadlock", "computer network", "TCP", "congestion control", "database", "transaction isolation",
+    "B-tree index", "compiler", "parsing", "finite automaton", "regular expression", "discrete math",
+    "propositional logic", "set theory", "combinatorics",
+]
+EN_FILLERS = ["is defined as", "is used for", "can be derived from", "compared with", "in lecture",
+              "a common example is", "note that", "the proof of", "applies to", "properties of"]
+CATEGORIES = ["概念", "例题", "FAQ", "公式", "实验"]
+
+
+class HashEmbeddingFunction:
+    """特征哈希嵌入：把词法分词结果哈希到固定维度并归一化。不依赖模型，速度快。"""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def __call__(self, input):
+        embeddings = []
+        for text in input:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for token in tokenize(text):
+                digest = hashlib.md5(token.encode("utf-8")).digest()
+                index = int.from_bytes(digest[:4], "little") % self.dim
+                vector[index] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vector)
+            embeddings.append((vector / norm if norm else vector).tolist())
+        return embeddings
+
+
+def generate_corpus(size, language, seed):
+    """生成合成语料，每个条目由若干术语和连接词组成。"""
+    rng = random.Random(seed)
+    terms, fillers = (ZH_TERMS, ZH_FILLERS) if language == "zh" else (EN_TERMS, EN_FILLERS)
+    separator = "" if language == "zh" else " "
+    for i in range(size):
+        topic = rng.sample(terms, 3)
+        sentences = []
+        for _ in range(rng.randint(2, 5)):
+            sentences.append(separator.join([rng.choice(topic), rng.choice(fillers), rng.choice(terms)]))
+        yield {
+            "id": i + 1,
+            "title": separator.join(topic[:2]) + f" #{i + 1}",
+            "content": ("。" if language == "zh" else ". ").join(sentences),
+            "course_id": rng.randint(1, COURSE_COUNT),
+            "category": rng.choice(CATEGORIES),
+            "tags": topic[:2],
+        }
+
+
+def generate_queries(count, language, seed):
+    """生成查询，每个查询包含一到两个术语。"""
+    rng = random.Random(seed + 1)
+    terms = ZH_TERMS if language == "zh" else EN_TERMS
+    separator = "" if language == "zh" else " "
+    return [
+        (separator.join(rng.sample(terms, rng.randint(1, 2))), rng.randint(1, COURSE_COUNT))
+        for _ in range(count)
+    ]
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def brute_force_top_k(matrix, ids, courses, query_embedding, k, course_id=None):
+    """暴力计算L2距离最近的k个条目，作为recall的真值。"""
+    distances = np.sum((matrix - query_embedding) ** 2, axis=1)
+    if course_id is not None:
+        distances = np.where(courses == course_id, distances, np.inf)
+    k = min(k, int(np.isfinite(distances).sum()))
+    if k == 0:
+        return set()
+    top = np.argpartition(distances, k - 1)[:k]
+    return {int(ids[i]) for i in top}
+
+
+def run_benchmark(size, language, args):
+    directory = tempfile.mkdtemp(prefix="kb-bench-")
+    try:
+        # 将服务指向临时目录中的集合
+        ext.chroma_client = PersistentClient(path=directory)
+        ext.embedding_function = HashEmbeddingFunction() if args.embedding == "hash" else DefaultEmbeddingFunction()
+        ext.embedding_cache = EmbeddingCache(os.path.join(directory, "embedding_cache.sqlite3"), args.embedding)
+        ext.knowledge_base_collection = ext.chroma_client.get_or_create_collection(
+            ext.KNOWLEDGE_BASE_COLLECTION, embedding_function=ext.embedding_function)
+
+        # 服务模块在导入时绑定了ext中的对象，需要重新指向临时集合；
+        # 词法索引直接在写入时构建，不从数据库加载
+        import app.services.knowledge_base_service as service
+        service.knowledge_base_collection = ext.knowledge_base_collection
+        service.embedding_function = ext.embedding_function
+        service.embedding_cache = ext.embedding_cache
+        service._lexical_index = LexicalIndex()
+
+        # 建立索引
+        ids, courses, vectors = [], [], []
+        batch = []
+        started = time.perf_counter()
+        for entry in generate_corpus(size, language, args.seed):
+            batch.append(entry)
+            if len(batch) >= args.batch_size:
+                index_batch(service, batch, ids, courses, vectors)
+                batch = []
+        if batch:
+            index_batch(service, batch, ids, courses, vectors)
+        index_seconds = time.perf_counter() - started
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids)
+        courses = np.asarray(courses)
+        del vectors
+
+        # 检索
+        report = {
+            "size": size,
+            "language": language,
+            "embedding": args.embedding,
+            "chunks": len(ids),
+            "index_seconds": round(index_seconds, 2),
+            "index_rate": round(size / index_seconds, 1),
+            "disk_bytes": directory_size(directory),
+        }
+        queries = generate_queries(args.queries, language, args.seed)
+        query_embeddings = np.asarray(ext.embedding_function([query for query, _ in queries]), dtype=np.float32)
+        for scope in ("global", "course"):
+            report[scope] = measure(service, queries, query_embeddings, matrix, ids, courses, scope, args)
+        return report
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def index_batch(service, batch, ids, courses, vectors):
+    """按KnowledgeBaseService的分块和嵌入方式写入一个批次的索引，并记录向量用于暴力检索。
+
+    条目不写入数据库，ID直接使用语料中的序号，因此这里调用的是服务内部的索引函数而不是bulk_add_knowledge。
+    """
+    chunk_ids, documents, metadatas = [], [], []
+    for entry in batch:
+        entry_ids, entry_documents, entry_metadatas = service._build_chunks(
+            str(entry["id"]), entry["id"], entry["title"], entry["content"],
+            entry["course_id"], entry["category"], entry["tags"])
+        chunk_ids.extend(entry_ids)
+        documents.extend(entry_documents)
+        metadatas.extend(entry_metadatas)
+    embeddings = service._embed(documents)
+    service.knowledge_base_collection.add(
+        ids=chunk_ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+    for entry in batch:
+        service._index_lexical(entry["id"], entry["title"], entry["content"],
+                               entry["course_id"], entry["category"], entry["tags"])
+    for metadata, embedding in zip(metadatas, embeddings):
+        ids.append(metadata["id"])
+        courses.append(metadata["course_id"])
+        vectors.append(embedding)
+
+
+def measure(service, queries, query_embeddings, matrix, ids, courses, scope, args):
+    """回放查询集，统计延迟、吞吐量和recall@k。"""
+    def search(query_and_course):
+        query, course_id = query_and_course
+        started = time.perf_counter()
+        results = service.KnowledgeBaseService.search_knowledge(
+            query,
+            course_id=course_id if scope == "course" else None,
+            limit=args.k,
+            include_record=False,
+            hybrid=args.hybrid
+        )
+        return time.perf_counter() - started, results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(search, queries))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in outcomes]
+    recalls = []
+    for (query, course_id), embedding, (_, results) in zip(queries, query_embeddings, outcomes):
+        truth = brute_force_top_k(matrix, ids, courses, embedding, args.k,
+                                  course_id if scope == "course" else None)
+        if truth:
+            recalls.append(len(truth & {result["id"] for result in results}) / len(truth))
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_qps": round(len(queries) / wall_seconds, 1),
+        f"recall@{args.k}": round(statistics.mean(recalls), 4) if recalls else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库检索性能基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="语料规模")
+    parser.add_argument("--languages", nargs="+", default=["zh", "en"], choices=["zh", "en"], help="语料语言")
+    parser.add_argument("--embedding", default="hash", choices=["hash", "model"], help="嵌入方式")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("--k", type=int, default=10, help="每个查询返回的结果数量，即recall@k的k")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发查询的线程数")
+    parser.add_argument("--batch-size", type=int, default=2000, help="写入批次大小")
+    parser.add_argument("--hybrid", action="store_true", help="使用混合检索")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output", help="将结果以JSON写入该文件")
+    args = parser.parse_args()
+
+    reports = []
+    for language in args.languages:
+        for size in args.sizes:
+            report = run_benchmark(size, language, args)
+            reports.append(report)
+            print(json.dumps(report, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(reports, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
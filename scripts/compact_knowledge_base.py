@@ -0,0 +1,90 @@
+"""离线重建(压缩)知识库向量集合。
+
+频繁更新和删除会在chroma_db/中的HNSW索引里留下大量已删除的节点。该脚本把现有集合的
+全部向量、文档和元数据复制到一个新集合中重新建立索引，校验条目数量一致后再替换原集合，
+同时为旧条目补写标签元数据键。
+
+请在应用停止时运行:
+    python -m scripts.compact_knowledge_base --batch-size 1000
+
+替换分两步重命名完成：原集合先重命名为备份集合，新集合再重命名为原名。如果在两步之间中断，
+应用或本脚本下次启动时(ext.recover_knowledge_base_swap)会把备份集合恢复为原集合，之后可以重新压缩。
+"""
+import argparse
+
+from app import create_app
+
+app = create_app()
+
+from app import ext
+from app.services.knowledge_base_service import TAG_KEY_PREFIX
+
+NAME = ext.KNOWLEDGE_BASE_COLLECTION
+COMPACT_NAME = ext.KNOWLEDGE_BASE_COMPACT_COLLECTION
+OLD_NAME = ext.KNOWLEDGE_BASE_BACKUP_COLLECTION
+
+
+def collection_names():
+    return {collection.name for collection in ext.chroma_client.list_collections()}
+
+
+def get_collection(name):
+    return ext.chroma_client.get_collection(name, embedding_function=ext.embedding_function)
+
+
+def with_tag_keys(metadata):
+    """为缺少标签键的旧元数据补写标签键。"""
+    metadata = dict(metadata)
+    for tag in filter(None, metadata.get("tags", "").split(",")):
+        metadata[TAG_KEY_PREFIX + tag] = True
+    return metadata
+
+
+def compact(batch_size):
+    source = get_collection(NAME)
+    if COMPACT_NAME in collection_names():
+        # 上次重建未完成，丢弃重新开始
+        ext.chroma_client.delete_collection(COMPACT_NAME)
+    # 复制集合元数据，保留距离函数等HNSW设置
+    target = ext.chroma_client.create_collection(
+        COMPACT_NAME, metadata=source.metadata or None, embedding_function=ext.embedding_function)
+
+    total = source.count()
+    for offset in range(0, total, batch_size):
+        batch = source.get(
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not batch["ids"]:
+            break
+        target.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=[with_tag_keys(metadata) for metadata in batch["metadatas"]]
+        )
+        print(f"已复制 {offset + len(batch['ids'])}/{total}")
+
+    if target.count() != total:
+        ext.chroma_client.delete_collection(COMPACT_NAME)
+        raise RuntimeError(f"重建后的条目数量 {target.count()} 与原集合 {total} 不一致，已放弃替换")
+
+    # 替换原集合
+    source.modify(name=OLD_NAME)
+    target.modify(name=NAME)
+    ext.chroma_client.delete_collection(OLD_NAME)
+    print(f"压缩完成，共 {total} 条向量。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线重建知识库向量集合")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批复制的条目数量")
+    args = parser.parse_args()
+
+    # create_app()已经恢复了上次中断的替换
+    compact(args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""批量导入知识库条目。
+
+输入文件为JSON Lines格式，每行一个知识条目:
+    {"title": "...", "content": "...", "course_id": 1, "category": "...", "tags": ["..."]}
+
+用法:
+    python -m scripts.import_knowledge data/input/knowledge.jsonl --batch-size 500
+
+默认在输入文件旁生成 <文件名>.checkpoint 断点文件。导入中断后使用相同参数重新运行即可从断点继续。
+"""
+import argparse
+import json
+import os
+
+from app import create_app
+
+app = create_app()
+
+from app.services.knowledge_base_service import KnowledgeBaseService
+
+
+def read_entries(path):
+    """逐行读取知识条目，跳过空行。"""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入知识库条目")
+    parser.add_argument("path", help="JSON Lines格式的知识条目文件")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批写入的条目数量")
+    parser.add_argument("--checkpoint", help="断点文件路径，默认为<path>.checkpoint")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or args.path + ".checkpoint"
+    imported = KnowledgeBaseService.bulk_add_knowledge(
+        read_entries(args.path),
+        batch_size=args.batch_size,
+        checkpoint_path=checkpoint_path
+    )
+    print(f"导入完成，新增 {imported} 条知识条目。")
+
+    # 全部完成后删除断点文件，下次导入同名文件时从头开始
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+if __name__ == '__main__':
+    main()
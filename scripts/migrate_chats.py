@@ -0,0 +1,35 @@
+"""为已有的chats和chat_messages表添加新字段:
+- chats.summary, chats.summary_until: 对话的滚动摘要
+- chat_messages.idempotency_key及其唯一索引: 发送消息的幂等键
+
+已存在的字段会被跳过，可以重复运行。
+
+用法:
+    python -m scripts.migrate_chats
+"""
+from app import create_app
+
+app = create_app()
+
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+from app.ext import db
+from app.models.chat import Chat, ChatMessage
+
+migrator = PostgresqlMigrator(db)
+operations = []
+
+chat_columns = {column.name for column in db.get_columns(Chat._meta.table_name)}
+if 'summary' not in chat_columns:
+    operations.append(migrator.add_column(Chat._meta.table_name, 'summary', Chat.summary))
+if 'summary_until' not in chat_columns:
+    operations.append(migrator.add_column(Chat._meta.table_name, 'summary_until', Chat.summary_until))
+
+message_columns = {column.name for column in db.get_columns(ChatMessage._meta.table_name)}
+if 'idempotency_key' not in message_columns:
+    operations.append(migrator.add_column(ChatMessage._meta.table_name, 'idempotency_key', ChatMessage.idempotency_key))
+    operations.append(migrator.add_index(ChatMessage._meta.table_name, ('chat_id', 'role', 'idempotency_key'), True))
+
+with db.atomic():
+    migrate(*operations)
+print(f"Applied {len(operations)} migration operation(s)")
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.job_queue import JobQueue, JobRejected, JobStatus
+
+
+def blocking_job(release):
+    def func(job):
+        release.wait(5)
+        return "done"
+    return func
+
+
+def failing_job(job):
+    raise ValueError("boom")
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_queue_full_is_rejected(release):
+    queue = JobQueue(max_workers=1, max_queued=1, per_owner_limit=10)
+    queue.submit("chat", 1, blocking_job(release))
+    queue.submit("chat", 2, blocking_job(release))
+
+    with pytest.raises(JobRejected) as rejected:
+        queue.submit("chat", 3, blocking_job(release))
+    assert rejected.value.reason == "queue_full"
+    assert queue.stats()["rejected"] == 1
+
+
+def test_user_limit_is_rejected(release):
+    queue = JobQueue(max_workers=4, max_queued=4, per_owner_limit=2)
+    queue.submit("chat", 1, blocking_job(release))
+    queue.submit("chat", 1, blocking_job(release))
+
+    with pytest.raises(JobRejected) as rejected:
+        queue.submit("chat", 1, blocking_job(release))
+    assert rejected.value.reason == "user_limit"
+    # other owners are not affected
+    queue.submit("chat", 2, blocking_job(release))
+
+
+def test_counters_go_down_after_a_job_fails():
+    queue = JobQueue(max_workers=1, max_queued=0, per_owner_limit=1)
+    job = queue.submit("chat", 1, failing_job)
+    assert job.wait(5)
+    assert job.status == JobStatus.FAILED
+    assert job.error == "boom"
+
+    # the worker releases its slot right after finishing the job
+    deadline = time.monotonic() + 5
+    while queue.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.stats()["in_flight"] == 0
+    assert queue._active == {}
+
+    second = queue.submit("chat", 1, lambda job: "ok")
+    assert second.wait(5)
+    assert second.result == "ok"
+
+
+def test_finished_jobs_are_pruned_after_retention():
+    queue = JobQueue(max_workers=1, retention=60)
+    job = queue.submit("chat", 1, lambda job: "ok")
+    assert job.wait(5)
+    assert queue.get(job.id) is job
+
+    job.finished_at = time.time() - 61
+    with queue._lock:
+        queue._prune()
+    assert queue.get(job.id) is None
+
+
+def test_unfinished_jobs_are_not_pruned(release):
+    queue = JobQueue(max_workers=1, retention=0)
+    job = queue.submit("chat", 1, blocking_job(release))
+    with queue._lock:
+        queue._prune()
+    assert queue.get(job.id) is job
+
+
+def test_subscribe_replays_events_after_index():
+    queue = JobQueue(max_workers=1)
+
+    def func(job):
+        for i in range(4):
+            job.publish("step", {"i": i})
+        return "ok"
+
+    job = queue.submit("chat", 1, func)
+    assert job.wait(5)
+
+    assert [(index, data["i"]) for index, _, data in job.subscribe(after=2)] == [(2, 2), (3, 3)]
+    assert list(job.subscribe(after=4)) == []
+
+
+def test_subscribe_follows_a_running_job(release):
+    queue = JobQueue(max_workers=1)
+
+    def func(job):
+        job.publish("step", 0)
+        release.wait(5)
+        job.publish("step", 1)
+        return "ok"
+
+    job = queue.submit("chat", 1, func)
+    events = job.subscribe(timeout=0.05)
+    assert next(events) == (0, "step", 0)
+    assert next(events) == (1, "ping", None)
+    release.set()
+    assert [event for event in events if event[1] != "ping"] == [(1, "step", 1)]
+
+
+def test_stream_job_replays_from_after():
+    stream_job = pytest.importorskip("app.views.jobs").stream_job
+    queue = JobQueue(max_workers=1)
+
+    def func(job):
+        job.publish("step", "a")
+        job.publish("step", "b")
+        return "ok"
+
+    job = queue.submit("chat", 1, func)
+    assert job.wait(5)
+
+    messages = list(stream_job(job, after=1))
+    assert messages[0] == 'id: 1\nevent: step\ndata: "b"\n\n'
+    assert messages[-1].startswith("event: job\n")
+    assert '"status": "succeeded"' in messages[-1]
+    assert len(messages) == 2
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from app.utils.json_repair import JSONRepairError, JSONTruncatedError, parse_json_object, repair_json
+
+
+def test_strict_json_is_not_repaired():
+    assert parse_json_object('{"answer": "ok"}') == ({"answer": "ok"}, False)
+
+
+def test_code_fence_and_surrounding_prose_are_ignored():
+    text = 'Here you go:\n```json\n{"action": [{"name": "wikipedia", "input": {"query": "x"}}]}\n```\nDone.'
+    value, repaired = parse_json_object(text)
+    assert value == {"action": [{"name": "wikipedia", "input": {"query": "x"}}]}
+    assert repaired is False
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("{'answer': 'ok'}", {"answer": "ok"}),
+    ('{answer: "ok"}', {"answer": "ok"}),
+    ('{"answer": "ok",}', {"answer": "ok"}),
+    ('{"items": [1, 2, 3,]}', {"items": [1, 2, 3]}),
+    ('{"done": True, "error": None}', {"done": True, "error": None}),
+    ('{"answer": "line one\nline two"}', {"answer": "line one\nline two"}),
+    ('{"answer": "ok" // a comment\n}', {"answer": "ok"}),
+    ('{"answer": /* note */ "ok"}', {"answer": "ok"}),
+    ('{"answer": "ok"} trailing text {"other": 1}', {"answer": "ok"}),
+    ("{'answer': 'he said \"hi\"'}", {"answer": 'he said "hi"'}),
+])
+def test_common_mistakes_are_repaired(text, expected):
+    value, repaired = parse_json_object(text)
+    assert value == expected
+    assert repaired is True
+
+
+@pytest.mark.parametrize("text", [
+    '{"answer": "trunc',
+    '{"answer": "部分',
+    '{"action": [{"name": "wikipedia", "input": {"query": "Hin',
+    '{"answer": ',
+    '{"action": [{"name": "wikipedia"},',
+])
+def test_cut_off_responses_are_rejected(text):
+    with pytest.raises(JSONTruncatedError):
+        parse_json_object(text)
+
+
+def test_cut_off_responses_can_be_accepted_explicitly():
+    assert parse_json_object('{"answer": "trunc', allow_truncated=True) == ({"answer": "trunc"}, True)
+
+
+def test_truncated_error_is_a_repair_error():
+    assert issubclass(JSONTruncatedError, JSONRepairError)
+    assert issubclass(JSONRepairError, ValueError)
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '{"a" "b"}'])
+def test_unrecoverable_text_raises(text):
+    with pytest.raises(JSONRepairError):
+        parse_json_object(text)
+
+
+@pytest.mark.parametrize("text", [
+    "{'a': 1, b: [True, None,], 'c': 'x\ty'}",
+    '{"a": {"b": [1, {"c": "d"}]}}',
+    '{"a": "trunc',
+    '[1, 2, {"a": ',
+])
+def test_repair_json_output_is_valid_json(text):
+    json.loads(repair_json(text))